@@ -15,15 +15,25 @@ from PIL import Image
 import matplotlib.pyplot as plt
 import imageio
 import sys, os
+import argparse
 import json
-from dataset import Dataset
+import threading
+from dataset import Dataset, pyramidLevel
 import signal
 from utils import notify
 from lassowidget import LassoWidget
+from canvaswidget import CanvasWidget
+import serializer
 
 DIR = os.path.dirname(os.path.realpath(__file__))
 QLassoLabeler, Ui_LassoLabeler = uic.loadUiType(f"{DIR}/LassoLabeler.ui", resource_suffix='')
 
+# ms the image list has to rest on an item before it is loaded, rows skipped while scrolling are never opened
+ITEM_LOAD_DELAY = 50
+
+# image views, selected at startup with --canvas
+CANVASES = {"matplotlib": LassoWidget, "native": CanvasWidget}
+
 # for ctrl + c to kill
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
@@ -65,19 +75,34 @@ class QLabelsQWidget (QtWidgets.QWidget):
         return self.lblName.text()
 
 class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
-    def __init__(self, parent=None):
+    # emitted from the loading threads, delivered in the GUI thread
+    itemLoaded = QtCore.pyqtSignal(str)
+    # emitted from the thread storing decoded video frames: (done,total), then (stored,cancel event)
+    frameStoreProgress = QtCore.pyqtSignal(int,int)
+    frameStoreDone = QtCore.pyqtSignal(bool,object)
+
+    def __init__(self, parent=None, canvas="matplotlib"):
         super(LassoLabeler,self).__init__(parent)
 
         self.setupUi(self)
-        self._actualImageWidget = LassoWidget(self.image_widget)
+        # the native canvas draws shapes as vector items over the unmodified image
+        self.nativeCanvas = canvas == "native"
+        Canvas = CANVASES[canvas]
+        self._actualImageWidget = Canvas(self.image_widget)
         self.image_layout.addWidget(self._actualImageWidget)
         self._actualImageWidget.selectionChanged.connect(self.on_lasso_finished)
-
-        self._maskWidget = LassoWidget(self.mask_widget)
+        self._actualImageWidget.viewChanged.connect(self.on_view_changed)
+        # pyramid level of the item shown, None when the views show something else
+        self.displayLevel = None
+        # part of a tiled item shown, in full resolution pixels
+        self.displayRegion = None
+        self.updatingView = False
+
+        self._maskWidget = Canvas(self.mask_widget)
         self.mask_layout.addWidget(self._maskWidget)
         self._maskWidget.disconnect()
 
-        self._boundingboxWidget = LassoWidget(self.boundingbox_widget)
+        self._boundingboxWidget = Canvas(self.boundingbox_widget)
         self.boundingbox_layout.addWidget(self._boundingboxWidget)
         self._boundingboxWidget.disconnect()
 
@@ -89,6 +114,26 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
         self.keysWidget = {}
         self.applyStyle()
         self.currentVideo = None
+        self.skippedMessage = ""
+
+        self.saveStatusTimer = QtCore.QTimer(self)
+        self.saveStatusTimer.timeout.connect(self.update_save_status)
+        self.saveStatusTimer.start(250)
+
+        # only the latest selected item is loaded and drawn
+        self.pendingItem = None
+        self.itemLoadTimer = QtCore.QTimer(self)
+        self.itemLoadTimer.setSingleShot(True)
+        self.itemLoadTimer.setInterval(ITEM_LOAD_DELAY)
+        self.itemLoadTimer.timeout.connect(self.start_item_load)
+        self.itemLoaded.connect(self.finish_item_load)
+
+        # decoded video frames are stored in the background, the video stays usable meanwhile
+        self.frameStoreThread = None
+        self.frameStoreCancel = None
+        self.frameStoreDialog = None
+        self.frameStoreProgress.connect(self.on_frame_store_progress)
+        self.frameStoreDone.connect(self.on_frame_store_done)
 
     def applyStyle(self):
         os.chdir(DIR + '/style')
@@ -144,26 +189,110 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
             self.ls_keys.addItem(keyListWidgetItem)
             self.ls_keys.setItemWidget(keyListWidgetItem, keyWidget)
         
-        for name in self.dataset.itemNames():
-            self.ls_images.addItem(name)
+        # one call for the whole list, rows of equal height aren't measured one by one
+        self.ls_images.setUniformItemSizes(True)
+        self.ls_images.addItems(self.dataset.itemNames())
         
         for video in self.dataset.videos():
             self.ls_videos.addItem(video)
     
         self.ls_images.setCurrentRow(0)
     
+    def display_level(self):
+        # the pyramid level matching the image view size and zoom
+        height,width = self.dataset.currentImageSize()
+        return pyramidLevel(self._actualImageWidget.imagePixelsPerScreenPixel(width,height))
+
     def update_image(self):
-        image = self.dataset.currentImage()
+        self.updatingView = True
+        self.displayRegion = None
+        if self.nativeCanvas and self.dataset.currentIsTiled():
+            # tiled items are shown a region at a time, the views need the full size to place them
+            height,width = self.dataset.currentImageSize()
+            for widget in (self._actualImageWidget,self._maskWidget,self._boundingboxWidget):
+                widget.setImageSize(width,height)
+        level = self.display_level()
+        scale = 2**level
+        self.displayLevel = level
+        if self.nativeCanvas:
+            # the images are only rewrapped when the item or level changes, a stroke updates the overlays
+            overlay = self.dataset.currentOverlay()
+            self._actualImageWidget.clear()
+            self._maskWidget.clear()
+            self._boundingboxWidget.clear()
+            if self.dataset.currentIsTiled():
+                self.update_region()
+            else:
+                image = self.dataset.currentRawImage(level)
+                self._actualImageWidget.updateImage(image,scale)
+                self._maskWidget.updateImage(self.dataset.currentMaskImage(level),scale)
+                self._boundingboxWidget.updateImage(image,scale)
+            self._actualImageWidget.setPolygons(overlay["polygons"])
+            self._actualImageWidget.setFilling(overlay["filling"])
+            self._boundingboxWidget.setBoxes(overlay["boxes"])
+            self.updatingView = False
+            return
+
+        image = self.dataset.currentImage(level)
         self._actualImageWidget.clear()
-        self._actualImageWidget.updateImage(image)
+        self._actualImageWidget.updateImage(image,scale)
 
-        maskImage = self.dataset.currentMaskImage()
+        maskImage = self.dataset.currentMaskImage(level)
         self._maskWidget.clear()
-        self._maskWidget.updateImage(maskImage)
+        self._maskWidget.updateImage(maskImage,scale)
 
-        boundingboxImage = self.dataset.currentBoundingboxImage()
+        boundingboxImage = self.dataset.currentBoundingboxImage(level)
         self._boundingboxWidget.clear()
-        self._boundingboxWidget.updateImage(boundingboxImage)
+        self._boundingboxWidget.updateImage(boundingboxImage,scale)
+        self.updatingView = False
+
+    def visible_region(self,margin=0):
+        # the part of a tiled item in view, grown by margin views on each side, aligned on the level
+        height,width = self.dataset.currentImageSize()
+        x1,y1,x2,y2 = self._actualImageWidget.visibleBox()
+        mx,my = (x2-x1)*margin,(y2-y1)*margin
+        return self.dataset.currentRegionBox((x1-mx,y1-my,x2+mx,y2+my),self.displayLevel)
+
+    def update_region(self):
+        # half a view of margin so that small pans are served from the region already shown
+        box = self.visible_region(0.5)
+        self.displayRegion = box
+        scale = 2**self.displayLevel
+        image = self.dataset.currentRawRegion(box,self.displayLevel)
+        self._actualImageWidget.updateImage(image,scale,box[:2])
+        self._maskWidget.updateImage(self.dataset.currentMaskRegion(box,self.displayLevel),scale,box[:2])
+        self._boundingboxWidget.updateImage(image,scale,box[:2])
+
+    def on_view_changed(self):
+        # only redrawn when another level or region is needed, and not while a video frame or thumbnail is shown
+        if self.displayLevel is None or self.updatingView:
+            return
+        level = self.display_level()
+        if self.displayRegion is not None and level == self.displayLevel:
+            x1,y1,x2,y2 = self.visible_region()
+            rx1,ry1,rx2,ry2 = self.displayRegion
+            if rx1 <= x1 and ry1 <= y1 and x2 <= rx2 and y2 <= ry2:
+                return
+            self.updatingView = True
+            self.update_region()
+            self.updatingView = False
+            return
+        if level == self.displayLevel:
+            return
+        self.update_image()
+
+    def update_save_status(self):
+        if not self.dataset or self.dataset.saveStatus() is None and not self.skippedMessage:
+            self.statusbar.clearMessage()
+            return
+        parts = []
+        if self.dataset.saveStatus() is not None:
+            parts.append(f"Annotation {self.dataset.saveStatus()}")
+        if self.dataset.saveError() is not None:
+            parts.append(f"Save failed, retrying: {self.dataset.saveError()}")
+        if self.skippedMessage:
+            parts.append(self.skippedMessage)
+        self.statusbar.showMessage(" | ".join(parts))
 
     def update_video_state(self):
         if not self.dataset.isVideoOpen(self.currentVideo):
@@ -196,7 +325,7 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
 
         self.update_image()
         if self.mn_save_automatically.isChecked():
-            self.dataset.save(self.mn_save_boundingbox.isChecked())
+            self.dataset.save(self.mn_save_boundingbox.isChecked(),background=True)
     
     def on_ln_search_key_textChanged(self):
         t = self.ln_search_key.text()
@@ -224,14 +353,60 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
             save = notify("Do you want save the current changes?","yesno")
             if save:
                 self.dataset.save(self.mn_save_boundingbox.isChecked())
+            else:
+                self.dataset.discardChanges()
 
+        self.pendingItem = current.text()
 
-        currentName = current.text()
+        # clearing lists, this also stops the lasso until the item is drawn at full size
+        self.ls_contours.clear()
+        self.ls_objects.clear()
+        self._actualImageWidget.disconnect()
+
+        thumbnail = self.dataset.thumbnail(self.pendingItem)
+        if thumbnail is not None:
+            self._actualImageWidget.clear()
+            self._actualImageWidget.updateImage(thumbnail)
+            self.displayLevel = None
+        self.itemLoadTimer.start()
+
+    def start_item_load(self):
+        name = self.pendingItem
+        future = self.dataset.requestItem(name)
+        if future is None:
+            self.finish_item_load(name)
+            return
+        if not future.done():
+            # a reduced JPEG decode is shown while the full resolution one runs in the background;
+            # the lasso only comes back with the full resolution item
+            levelFor = lambda height,width: pyramidLevel(self._actualImageWidget.imagePixelsPerScreenPixel(width,height))
+            preview = self.dataset.preview(name,levelFor)
+            if preview is not None:
+                image,scale = preview
+                self._actualImageWidget.clear()
+                self._actualImageWidget.updateImage(image,scale)
+                self.displayLevel = None
+        future.add_done_callback(lambda f: self.itemLoaded.emit(name))
+
+    def finish_item_load(self,name):
+        # a newer selection supersedes this one
+        if name != self.pendingItem:
+            return
 
         # changing the image
-        self.dataset.changeItem(currentName,False)
+        if name != self.dataset.currentItemName():
+            self.dataset.changeItem(name,False)
         self.update_image()
 
+        skipped = self.dataset.skippedShapes()
+        self.skippedMessage = ""
+        if skipped:
+            reasons = sorted(set(reason for _,_,reason in skipped))
+            self.skippedMessage = f"{len(skipped)} shapes not loaded: {', '.join(reasons)}"
+            self.statusbar.setToolTip("\n".join(f"#{i} {label}: {reason}" for i,label,reason in skipped))
+        else:
+            self.statusbar.setToolTip("")
+
         # clearing lists
         self.ls_contours.clear()
         self.ls_objects.clear()
@@ -294,9 +469,31 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
         if not sucess:
             notify(errorMsg)
             return
+        if self.dataset:
+            self.stop_frame_store()
+            self.dataset.close()
         self.dataset = dataset
+        self.pendingItem = None
+        self.displayLevel = None
+        self.dataset.setJournal(self.mn_journal_edits.isChecked())
+        self.dataset.setBoundingBox(self.mn_save_boundingbox.isChecked())
+        self.dataset.setPrefetchComposite(not self.nativeCanvas)
         self.clear_and_populate()
 
+    @QtCore.pyqtSlot(bool)
+    def on_mn_journal_edits_toggled(self,checked):
+        if self.dataset:
+            self.dataset.setJournal(checked)
+
+    @QtCore.pyqtSlot(bool)
+    def on_mn_save_boundingbox_toggled(self,checked):
+        if self.dataset:
+            self.dataset.setBoundingBox(checked)
+
+    @QtCore.pyqtSlot(bool)
+    def on_mn_compact_annotations_toggled(self,checked):
+        serializer.configure(compact=checked)
+
     def on_keys_rightClicked(self,QPos):
         self.listMenu= QtWidgets.QMenu()
         menu_item = self.listMenu.addAction(QtWidgets.QAction('Create object',self,triggered=self.on_create_object_clicked))
@@ -341,7 +538,7 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
 
         self.update_image()
         if self.mn_save_automatically.isChecked():
-            self.dataset.save(self.mn_save_boundingbox.isChecked())
+            self.dataset.save(self.mn_save_boundingbox.isChecked(),background=True)
 
     def on_pb_goto_released(self):
         try:
@@ -353,6 +550,7 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
         if ret:
             self._actualImageWidget.clear()
             self._actualImageWidget.updateImage(frame)
+            self.displayLevel = None
             self._maskWidget.clear()
             self._boundingboxWidget.clear()
             self.update_video_state()
@@ -366,6 +564,7 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
         if ret:
             self._actualImageWidget.clear()
             self._actualImageWidget.updateImage(frame)
+            self.displayLevel = None
             self._maskWidget.clear()
             self._boundingboxWidget.clear()
             self.update_video_state()
@@ -379,10 +578,91 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
         if ret:
             self._actualImageWidget.clear()
             self._actualImageWidget.updateImage(frame)
+            self.displayLevel = None
             self._maskWidget.clear()
             self._boundingboxWidget.clear()
             self.update_video_state()
     
+    def ask_frame_store_settings(self,length):
+        # frame range and scale of the store, None when cancelled
+        dialog = QtWidgets.QDialog(self)
+        dialog.setWindowTitle("Cache Video Frames")
+        layout = QtWidgets.QFormLayout(dialog)
+        start = QtWidgets.QSpinBox(dialog)
+        start.setRange(0,max(0,length-1))
+        end = QtWidgets.QSpinBox(dialog)
+        end.setRange(1,max(1,length))
+        end.setValue(length)
+        scale = QtWidgets.QDoubleSpinBox(dialog)
+        scale.setRange(0.1,1.0)
+        scale.setSingleStep(0.1)
+        scale.setValue(1.0)
+        size = QtWidgets.QLabel(dialog)
+        width,height = self.dataset.videoSize(self.currentVideo)
+        def updateSize():
+            frames = max(0,end.value() - start.value())
+            nbytes = frames * max(1,int(width*scale.value())) * max(1,int(height*scale.value())) * 3
+            size.setText(f"{nbytes / 1024**3:.1f} GB")
+        for spin in (start,end,scale):
+            spin.valueChanged.connect(updateSize)
+        updateSize()
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel,parent=dialog)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addRow("First frame",start)
+        layout.addRow("End frame",end)
+        layout.addRow("Scale",scale)
+        layout.addRow("Disk space",size)
+        layout.addRow(buttons)
+        if dialog.exec_() != QtWidgets.QDialog.Accepted or start.value() >= end.value():
+            return None
+        return start.value(),end.value(),scale.value()
+
+    def start_frame_store(self):
+        settings = self.ask_frame_store_settings(self.dataset.videoLength(self.currentVideo))
+        if settings is None:
+            return
+        start,end,scale = settings
+        videoId = self.currentVideo
+        cancel = threading.Event()
+        def build():
+            stored = self.dataset.storeVideoFrames(videoId,start,end,scale,self.frameStoreProgress.emit,cancel)
+            self.frameStoreDone.emit(stored,cancel)
+
+        self.frameStoreDialog = QtWidgets.QProgressDialog("Storing decoded frames","Cancel",0,end-start,self)
+        self.frameStoreDialog.setMinimumDuration(0)
+        self.frameStoreDialog.canceled.connect(cancel.set)
+        self.frameStoreCancel = cancel
+        self.frameStoreThread = threading.Thread(target=build,daemon=True)
+        self.frameStoreThread.start()
+
+    def stop_frame_store(self):
+        if self.frameStoreThread is None:
+            return
+        self.frameStoreCancel.set()
+        self.frameStoreThread.join()
+        self.frameStoreThread = None
+        self.frameStoreCancel = None
+        if self.frameStoreDialog is not None:
+            self.frameStoreDialog.close()
+            self.frameStoreDialog = None
+
+    def on_frame_store_progress(self,done,total):
+        if self.frameStoreDialog is not None:
+            self.frameStoreDialog.setValue(done)
+
+    def on_frame_store_done(self,stored,cancel):
+        # a build stopped by stop_frame_store, possibly followed by another one
+        if cancel is not self.frameStoreCancel:
+            return
+        self.frameStoreThread = None
+        self.frameStoreCancel = None
+        if self.frameStoreDialog is not None:
+            self.frameStoreDialog.close()
+            self.frameStoreDialog = None
+        if not stored and not cancel.is_set():
+            notify("Could not store decoded frames, reading the video directly","error")
+
     def on_pb_open_video_released(self):
         opened = self.dataset.openVideo(self.currentVideo)
         if opened:
@@ -394,15 +674,19 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
             if ret:
                 self._actualImageWidget.clear()
                 self._actualImageWidget.updateImage(frame)
+                self.displayLevel = None
                 self._maskWidget.clear()
                 self._boundingboxWidget.clear()
                 self.update_video_state()
+            if self.mn_cache_video_frames.isChecked():
+                self.start_frame_store()
         else:
             self.pb_sample.setEnabled(False)
             self.pb_open_video.setEnabled(True)
             self.pb_close_video.setEnabled(False)
         
     def on_pb_close_video_released(self):
+        self.stop_frame_store()
         closed = self.dataset.closeVideo(self.currentVideo)
         if closed:
             self.pb_open_video.setEnabled(True)
@@ -427,6 +711,7 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
         self.ls_images.setCurrentRow(frameId)
 
         # changing the image
+        self.itemLoadTimer.stop()
         self.dataset.changeItem(frameName,False)
         self.update_image()
 
@@ -438,6 +723,13 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
         for o in self.dataset.objectNames():
             self.ls_objects.addItem(o)
 
+    def closeEvent(self, e):
+        # writes whatever the autosave is still holding
+        if self.dataset:
+            self.stop_frame_store()
+            self.dataset.close()
+        super(LassoLabeler,self).closeEvent(e)
+
     def keyPressEvent(self, e):
         if e.key()  == QtCore.Qt.Key_Right:
             if not self.dataset.isVideoOpen(self.currentVideo):
@@ -453,8 +745,11 @@ class LassoLabeler(QLassoLabeler, Ui_LassoLabeler):
             self.on_pb_sample_released()
 
 if __name__ == '__main__':
-	app = QtWidgets.QApplication(sys.argv)
-	form = LassoLabeler(None)
+	parser = argparse.ArgumentParser(description="LassoLabeler")
+	parser.add_argument("--canvas",choices=sorted(CANVASES),default="matplotlib",help="image view backend")
+	args,qtArgs = parser.parse_known_args()
+	app = QtWidgets.QApplication(sys.argv[:1] + qtArgs)
+	form = LassoLabeler(None,args.canvas)
 	form.show()
 	sys.exit(app.exec_())
 
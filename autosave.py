@@ -0,0 +1,101 @@
+import threading
+import time
+
+# seconds an item has to stay untouched before its pending save is written
+AUTOSAVE_DELAY = 1.0
+# seconds before a save that failed is tried again
+AUTOSAVE_RETRY_DELAY = 5.0
+
+DIRTY = "dirty"
+SAVING = "saving"
+SAVED = "saved"
+
+
+class AutoSaver:
+    ''' coalesces bursts of save requests per key into one background write '''
+    def __init__(self,delay=AUTOSAVE_DELAY,retryDelay=AUTOSAVE_RETRY_DELAY):
+        self._delay = delay
+        self._retryDelay = retryDelay
+        self._pending = {} # key -> (deadline, save)
+        self._writing = set()
+        self._status = {}
+        self._errors = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,daemon=True)
+        self._thread.start()
+
+    def schedule(self,key,save):
+        with self._cond:
+            self._pending[key] = (time.monotonic() + self._delay, save)
+            self._status[key] = DIRTY
+            self._cond.notify_all()
+
+    def status(self,key):
+        with self._cond:
+            return self._status.get(key)
+
+    def error(self,key):
+        with self._cond:
+            return self._errors.get(key)
+
+    def _write(self,key,save):
+        try:
+            save()
+            error = None
+        except Exception as e:
+            error = e
+        with self._cond:
+            self._writing.discard(key)
+            if error is not None:
+                self._errors[key] = error
+                self._status[key] = DIRTY
+                # kept pending, a newer save of the key replaces the failed one
+                if key not in self._pending:
+                    self._pending[key] = (time.monotonic() + self._retryDelay, save)
+            else:
+                self._errors.pop(key,None)
+                if key not in self._pending:
+                    self._status[key] = SAVED
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    due = [(d,k) for k,(d,_) in self._pending.items() if k not in self._writing]
+                    if due and min(due)[0] <= now:
+                        break
+                    self._cond.wait(min(due)[0] - now if due else None)
+                if self._stopped:
+                    return
+                _,key = min(due)
+                _,save = self._pending.pop(key)
+                self._writing.add(key)
+                self._status[key] = SAVING
+            self._write(key,save)
+
+    def flush(self,key=None):
+        # writes the pending saves of key (or all keys) now, in the calling thread
+        with self._cond:
+            keys = list(self._pending.keys()) if key is None else [key]
+            while any(k in self._writing for k in keys):
+                self._cond.wait()
+            saves = []
+            for k in keys:
+                if k in self._pending:
+                    _,save = self._pending.pop(k)
+                    self._writing.add(k)
+                    self._status[k] = SAVING
+                    saves.append((k,save))
+        for k,save in saves:
+            self._write(k,save)
+
+    def close(self,flush=True):
+        if flush:
+            self.flush()
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
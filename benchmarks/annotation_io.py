@@ -0,0 +1,51 @@
+''' Load and save throughput of annotation files for each serializer mode, over a synthetic folder. '''
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import serializer
+from dataset import Annotation
+
+def build(path, objects=10, points=40):
+    annotation = Annotation(path)
+    for o in range(objects):
+        center = np.random.rand(2) * 1000 + 100
+        angles = np.linspace(0, 2*np.pi, points, endpoint=False)
+        polygon = np.stack([center[0] + 50*np.cos(angles), center[1] + 50*np.sin(angles)], axis=1)
+        annotation.addShape("person", "polygon", polygon.tolist(), f"person_{o+1}")
+    return annotation
+
+def main(files=10000):
+    np.random.seed(0)
+    modes = [("json indent=4", dict(compact=False, fast=False)),
+             ("json compact", dict(compact=True, fast=False))]
+    if serializer.orjson is not None:
+        modes.append(("orjson compact", dict(compact=True, fast=True)))
+    else:
+        print("orjson not installed, skipping the fast backend")
+
+    with tempfile.TemporaryDirectory() as folder:
+        annotations = [build(f"{folder}/{i}.json") for i in range(files)]
+        for name, options in modes:
+            serializer.configure(**options)
+
+            start = time.perf_counter()
+            for annotation in annotations:
+                annotation.save("../imgs/x.jpg", 1280, 1280)
+            save = time.perf_counter() - start
+            size = sum(os.path.getsize(f"{folder}/{i}.json") for i in range(files))
+
+            start = time.perf_counter()
+            for i in range(files):
+                Annotation.fromJson(f"{folder}/{i}.json")
+            load = time.perf_counter() - start
+
+            print(f"{name:15s} save {files/save:8.0f} files/s  load {files/load:8.0f} files/s  {size/files/1024:6.1f} KB/file")
+
+if __name__ == "__main__":
+    main()
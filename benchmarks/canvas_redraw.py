@@ -0,0 +1,76 @@
+''' Per-stroke redraw time of the three image views with the matplotlib and the native canvas,
+    at full resolution and at the pyramid level matching the view. '''
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt5 import QtWidgets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from dataset import DatasetItem, pyramidLevel
+from lassowidget import LassoWidget
+from canvaswidget import CanvasWidget
+
+def random_stroke(width, height, size=300, n=200):
+    cx, cy = random.randrange(size, width-size), random.randrange(size, height-size)
+    angles = np.linspace(0, 2*np.pi, n)
+    radius = size * (0.5 + 0.5*np.random.rand(n))
+    return np.stack([cx + radius*np.cos(angles), cy + radius*np.sin(angles)], axis=1).tolist()
+
+def redraw_matplotlib(widgets, item, level):
+    for widget, image in zip(widgets, (item.image(level), item.maskImage(level), item.boundingboxImage(level))):
+        widget.clear()
+        widget.updateImage(image, 2**level)
+
+def redraw_native(widgets, item, level):
+    image, mask, boxes = widgets
+    overlay = item.overlay()
+    image.updateImage(item.rawImage(level), 2**level)
+    image.setPolygons(overlay["polygons"])
+    image.setFilling(overlay["filling"])
+    mask.updateImage(item.maskImage(level), 2**level)
+    boxes.updateImage(item.rawImage(level), 2**level)
+    boxes.setBoxes(overlay["boxes"])
+    for widget in widgets:
+        # paints now instead of on the next event loop pass
+        widget.viewport().repaint()
+
+def main(width=5472, height=3648, strokes=20):
+    app = QtWidgets.QApplication(sys.argv[:1])
+    with tempfile.TemporaryDirectory() as folder:
+        imgPath = f"{folder}/synthetic.png"
+        Image.fromarray(np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)).save(imgPath)
+
+        print(f"{width}x{height}, {strokes} strokes")
+        for name, Canvas, redraw, fitted in (("matplotlib", LassoWidget, redraw_matplotlib, False), ("native", CanvasWidget, redraw_native, False),
+                                            ("matplotlib", LassoWidget, redraw_matplotlib, True), ("native", CanvasWidget, redraw_native, True)):
+            random.seed(0)
+            np.random.seed(0)
+            item = DatasetItem("synthetic", imgPath, f"{folder}/synthetic.json", f"{folder}/synthetic.jpg", 0)
+            item.open()
+            item.createObject("object")
+            widgets = [Canvas(None) for _ in range(3)]
+            for widget in widgets:
+                widget.resize(800, 600)
+            level = pyramidLevel(widgets[0].imagePixelsPerScreenPixel(width, height)) if fitted else 0
+            redraw(widgets, item, level)
+
+            elapsed = 0.0
+            for i in range(strokes):
+                item.addShape("object", "polygon", random_stroke(width, height), "object_1")
+                item.fillInContour("object_1", i)
+                start = time.perf_counter()
+                redraw(widgets, item, level)
+                elapsed += time.perf_counter() - start
+            item.close()
+            print(f"{name}, level {level}:".ljust(24) + f"{elapsed/strokes*1000:.1f} ms/stroke")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+''' Opening and rendering a crowded item: the label map path against the baseline's colored drawing, both one OpenCV call per shape. '''
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from dataset import DatasetItem
+
+def random_polygon(width, height, size=40, n=60):
+    cx, cy = np.random.randint(size, width-size), np.random.randint(size, height-size)
+    angles = np.linspace(0, 2*np.pi, n, endpoint=False)
+    radius = size * (0.5 + 0.5*np.random.rand(n))
+    return np.stack([cx + radius*np.cos(angles), cy + radius*np.sin(angles)], axis=1).tolist()
+
+def write_annotation(path, width, height, objects, shapesPerObject):
+    shapes = [{"label": "person", "points": random_polygon(width, height), "group_id": f"person_{i//shapesPerObject+1}",
+               "shape_type": "polygon", "flags": {}} for i in range(objects*shapesPerObject)]
+    with open(path, "w") as f:
+        json.dump({"version": "4.5.6", "flags": {}, "shapes": shapes, "imagePath": "", "imageData": None,
+                   "imageHeight": height, "imageWidth": width}, f)
+
+def legacy_render(image, shapes, colors):
+    # the baseline code path on the labelme dicts it kept in memory: the borders drawn on open,
+    # maskImage and boundingboxImage, one OpenCV call per shape and one rectangle per object
+    maskColor = np.zeros_like(image)
+    for s in shapes:
+        polygon = np.array(s["points"]).reshape((-1,1,2)).astype(np.int32)
+        maskColor = cv2.drawContours(maskColor, [polygon], -1, color=colors[s["group_id"]], thickness=5)
+    objectShapes = {}
+    for s in shapes:
+        objectShapes.setdefault(s["group_id"], []).append(s)
+    img = np.zeros_like(image)
+    for o, objShapes in objectShapes.items():
+        for s in objShapes:
+            polygon = np.array(s["points"]).reshape((-1,1,2)).astype(np.int32)
+            img = cv2.drawContours(img, [polygon], -1, color=colors[o], thickness=cv2.FILLED)
+    img = image.copy()
+    for o, objShapes in objectShapes.items():
+        polygon = np.array(objShapes[0]["points"])
+        x1, y1, x2, y2 = polygon[:,0].min(), polygon[:,1].min(), polygon[:,0].max(), polygon[:,1].max()
+        for s in objShapes[1:]:
+            polygon = np.array(s["points"])
+            x1, y1 = min(x1, polygon[:,0].min()), min(y1, polygon[:,1].min())
+            x2, y2 = max(x2, polygon[:,0].max()), max(y2, polygon[:,1].max())
+        img = cv2.rectangle(img, (int(x1),int(y1)), (int(x2),int(y2)), color=colors[o], thickness=2)
+
+def labelmap_render(item):
+    item.updateMask()
+    item.maskImage()
+    item.boundingboxImage()
+
+def main(width=4000, height=3000, objects=800, shapesPerObject=1, repeats=5):
+    np.random.seed(0)
+    with tempfile.TemporaryDirectory() as folder:
+        imgPath = f"{folder}/crowd.png"
+        annotationPath = f"{folder}/crowd.json"
+        Image.fromarray(np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)).save(imgPath)
+        write_annotation(annotationPath, width, height, objects, shapesPerObject)
+        item = DatasetItem("crowd", imgPath, annotationPath, f"{folder}/crowd.jpg", 0)
+        item.open()
+        with open(annotationPath) as f:
+            shapes = json.load(f)["shapes"]
+        annotation = item.annotation()
+        colors = {o: annotation.getColor(o) for o in annotation.getObjectNames()}
+
+        timings = {}
+        for name, render in (("per shape", lambda: legacy_render(item._imgArray, shapes, colors)),
+                             ("label map", lambda: labelmap_render(item))):
+            # the best run, the mean is dominated by noise from other processes
+            runs = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                render()
+                runs.append(time.perf_counter() - start)
+            timings[name] = min(runs)
+
+        boxColors = len({tuple(c) for c in colors.values()})
+        calls = {"per shape": f"{2*len(shapes)} drawContours, {len(colors)} rectangle",
+                 "label map": f"{len(shapes)} drawContours, {len(shapes) + 1 + boxColors} polylines"}
+        print(f"{width}x{height}, {objects} objects, {len(shapes)} shapes")
+        for name, t in timings.items():
+            print(f"{name:10s} {t*1000:.1f} ms  {calls[name]}")
+
+if __name__ == "__main__":
+    # a crowd of one shape per object, then objects drawn as several pieces
+    main()
+    main(objects=200, shapesPerObject=4)
@@ -0,0 +1,39 @@
+''' Time to a first image with DatasetItem.preview against a full resolution JPEG decode. '''
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from dataset import DatasetItem
+
+def main(width=5472, height=3648, runs=10):
+    with tempfile.TemporaryDirectory() as folder:
+        imgPath = f"{folder}/synthetic.jpg"
+        # smooth content so the file size is that of a photo, not of noise
+        gradient = np.linspace(0, 255, width, dtype=np.uint8)
+        image = np.stack([np.tile(gradient, (height, 1))]*3, axis=2)
+        Image.fromarray(image).save(imgPath, quality=90)
+        item = DatasetItem("synthetic", imgPath, f"{folder}/synthetic.json", f"{folder}/synthetic.jpg", 0)
+
+        start = time.perf_counter()
+        for _ in range(runs):
+            with Image.open(imgPath) as img:
+                np.asarray(img)
+        full = (time.perf_counter() - start) / runs
+
+        print(f"{width}x{height}")
+        print(f"{'full:':10}{full*1000:.1f} ms")
+        for level in (1, 2, 3):
+            start = time.perf_counter()
+            for _ in range(runs):
+                preview, scale = item.preview(lambda h, w: level)
+            elapsed = (time.perf_counter() - start) / runs
+            print(f"{f'1/{scale}:':10}{elapsed*1000:.1f} ms  {preview.shape[1]}x{preview.shape[0]}")
+
+if __name__ == "__main__":
+    main()
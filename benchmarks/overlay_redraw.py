@@ -0,0 +1,69 @@
+''' Per-stroke redraw time of DatasetItem.image against the previous full-frame compositing. '''
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from dataset import DatasetItem
+
+def legacy_image(imgArray, maskColor, contourFilling):
+    image = imgArray.copy()
+    borderMask = np.where(maskColor != [0,0,0])
+    fillingMask = np.where(contourFilling != [0,0,0])
+    image[borderMask] = maskColor[borderMask]
+    if fillingMask[0].shape[0] > 0:
+        filling = (image[fillingMask].astype(float) + 0.4*contourFilling[fillingMask].astype(float)).clip(0,255).astype(np.uint8)
+        image[fillingMask] = filling
+    return image
+
+def random_stroke(width, height, size=300, n=200):
+    cx, cy = random.randrange(size, width-size), random.randrange(size, height-size)
+    angles = np.linspace(0, 2*np.pi, n)
+    radius = size * (0.5 + 0.5*np.random.rand(n))
+    return np.stack([cx + radius*np.cos(angles), cy + radius*np.sin(angles)], axis=1).tolist()
+
+def main(width=5472, height=3648, strokes=30):
+    random.seed(0)
+    np.random.seed(0)
+    with tempfile.TemporaryDirectory() as folder:
+        imgPath = f"{folder}/synthetic.png"
+        Image.fromarray(np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)).save(imgPath)
+        item = DatasetItem("synthetic", imgPath, f"{folder}/synthetic.json", f"{folder}/synthetic.jpg", 0)
+        item.open()
+        item.createObject("object")
+        item.image()
+        # RGB overlays as the full-frame implementation kept them
+        maskColor = np.zeros_like(item._imgArray)
+        contourFilling = np.zeros_like(item._imgArray)
+
+        legacy, incremental = 0.0, 0.0
+        for i in range(strokes):
+            stroke = random_stroke(width, height)
+            item.addShape("object", "polygon", stroke, "object_1")
+            item.fillInContour("object_1", i)
+            polygon = np.array(stroke).reshape((-1,1,2)).astype(np.int32)
+            cv2.drawContours(maskColor, [polygon], -1, color=item.annotation().getColor("object_1"), thickness=5)
+            contourFilling[...] = 0
+            cv2.drawContours(contourFilling, [polygon], -1, color=(0,0,255), thickness=cv2.FILLED)
+
+            start = time.perf_counter()
+            legacy_image(item._imgArray, maskColor, contourFilling)
+            legacy += time.perf_counter() - start
+
+            start = time.perf_counter()
+            item.image()
+            incremental += time.perf_counter() - start
+
+        print(f"{width}x{height}, {strokes} strokes")
+        print(f"full frame:   {legacy/strokes*1000:.1f} ms/stroke")
+        print(f"dirty region: {incremental/strokes*1000:.1f} ms/stroke")
+
+if __name__ == "__main__":
+    main()
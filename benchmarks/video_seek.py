@@ -0,0 +1,57 @@
+''' Random access latency of Video.goto with and without the keyframe index on a synthetic video.
+    The index needs PyAV (pip install av), without it both runs seek through OpenCV. '''
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from dataset import Video
+import videoindex
+
+def create_video(path, frames=1500, width=1280, height=720, fps=30):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for i in range(frames):
+        frame = np.full((height, width, 3), i % 255, dtype=np.uint8)
+        cv2.putText(frame, str(i), (50, height//2), cv2.FONT_HERSHEY_SIMPLEX, 5, (255, 255, 255), 10)
+        writer.write(frame)
+    writer.release()
+
+def bench(path, targets, useKeyframeIndex):
+    video = Video(path, cacheBudget=0, prefetchDepth=0, useKeyframeIndex=useKeyframeIndex)
+    video.open()
+    # the index is built in the background, the timed gotos should all go through it
+    if video._indexThread is not None:
+        video._indexThread.join()
+    start = time.perf_counter()
+    for t in targets:
+        video.goto(t)
+    elapsed = time.perf_counter() - start
+    video.close()
+    return elapsed / len(targets)
+
+def main():
+    if videoindex.av is None:
+        print("PyAV is not installed: there is no keyframe index and both runs seek through OpenCV", file=sys.stderr)
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as folder:
+        path = f"{folder}/synthetic.mp4"
+        create_video(path)
+        video = Video(path)
+        video.open()
+        numOfFrames = video.numOfFrames()
+        video.close()
+        targets = [random.randrange(numOfFrames) for _ in range(200)]
+
+        plain = bench(path, targets, False)
+        indexed = bench(path, targets, True)
+        print(f"seek only:      {plain*1000:.2f} ms/goto")
+        print(f"keyframe index: {indexed*1000:.2f} ms/goto")
+
+if __name__ == "__main__":
+    main()
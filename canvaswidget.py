@@ -0,0 +1,251 @@
+from PyQt5.QtCore import Qt,pyqtSignal,QPointF,QRectF
+from PyQt5.QtGui import QImage,QPainter,QPainterPath,QPen,QBrush,QColor,QPolygonF
+from PyQt5 import QtWidgets
+import numpy as np
+
+# QImage formats that read a uint8 numpy buffer as it is, by number of channels
+FORMATS = {1: QImage.Format_Grayscale8, 3: QImage.Format_RGB888, 4: QImage.Format_RGBA8888}
+# widths in image pixels, as burned into the pixels by DatasetItem
+BORDER_WIDTH = 5
+BOX_WIDTH = 2
+# 0.4 of (0,0,255), as the filling added by DatasetItem
+FILLING_COLOR = (0,0,255,102)
+ZOOM_STEP = 1.25
+
+
+def _polygon(points):
+    # fills the QPolygonF buffer straight from numpy instead of one QPointF per vertex
+    points = np.asarray(points,dtype=np.float64).reshape((-1,2))
+    polygon = QPolygonF(len(points))
+    if len(points) > 0:
+        buffer = polygon.data()
+        buffer.setsize(points.nbytes)
+        np.frombuffer(buffer,dtype=np.float64)[:] = points.ravel()
+    return polygon
+
+
+class ImageItem(QtWidgets.QGraphicsItem):
+    ''' paints a numpy image through a QImage sharing its buffer '''
+    def __init__(self):
+        super(ImageItem,self).__init__()
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+        self._array = None
+        self._qimage = None
+
+    def array(self):
+        return self._array
+
+    def setArray(self,array):
+        self.prepareGeometryChange()
+        # no copy for the contiguous uint8 arrays the dataset hands over
+        array = np.ascontiguousarray(array,dtype=np.uint8)
+        channels = 1 if array.ndim == 2 else array.shape[2]
+        height,width = array.shape[:2]
+        # the QImage doesn't own the buffer, the array has to outlive it
+        self._array = array
+        self._qimage = QImage(array.data,width,height,array.strides[0],FORMATS[channels])
+        self.update()
+
+    def boundingRect(self):
+        if self._qimage is None:
+            return QRectF()
+        return QRectF(0,0,self._qimage.width(),self._qimage.height())
+
+    def paint(self,painter,option,widget=None):
+        if self._qimage is not None:
+            painter.drawImage(option.exposedRect,self._qimage,option.exposedRect)
+
+
+class CanvasWidget(QtWidgets.QGraphicsView):
+    ''' QGraphicsView alternative to LassoWidget, shapes are vector items over an unmodified image '''
+    selectionChanged = pyqtSignal(list)
+    # the screen pixels covering the image changed, on resize or zoom
+    viewChanged = pyqtSignal()
+    def __init__(self,parent,image=None):
+        super(CanvasWidget,self).__init__(parent)
+        self.setScene(QtWidgets.QGraphicsScene(self))
+        self.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
+        self.setRenderHints(QPainter.Antialiasing | QPainter.SmoothPixmapTransform)
+        self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
+        self.setViewportUpdateMode(QtWidgets.QGraphicsView.SmartViewportUpdate)
+
+        self._image = ImageItem()
+        # pixel centers on integer coordinates, as with matplotlib's imshow
+        self._image.setPos(-0.5,-0.5)
+        self.scene().addItem(self._image)
+        self._overlays = {"polygons": [],"boxes": [],"filling": []}
+        # full resolution extent of the image, larger than the item shown when it is a region
+        self._imageRect = QRectF()
+
+        pen = QPen(QColor(0,128,0),2)
+        pen.setCosmetic(True)
+        self._lassoLine = self.scene().addPath(QPainterPath(),pen)
+        self._lassoLine.setZValue(3)
+        self._lassoPoints = None
+        self._lassoPath = None
+        self._connected = False
+        self._zoomed = False
+
+        if image is not None:
+            self.updateImage(image)
+        self.disconnect()
+
+    def connect(self):
+        self._connected = True
+        self.setDragMode(QtWidgets.QGraphicsView.NoDrag)
+
+    def disconnect(self):
+        self._connected = False
+        self._lassoPoints = None
+        self.setDragMode(QtWidgets.QGraphicsView.ScrollHandDrag)
+
+    def clear(self):
+        self._lassoLine.setPath(QPainterPath())
+        self._lassoLine.setVisible(False)
+        self._lassoPoints = None
+
+    def setImageSize(self,width,height):
+        ''' the full resolution size of an image shown a region at a time, see updateImage '''
+        rect = QRectF(-0.5,-0.5,width,height)
+        if rect == self._imageRect:
+            return
+        self._imageRect = rect
+        for key in self._overlays:
+            self._setOverlay(key,[])
+        self._fit()
+
+    def updateImage(self,image,scale=1,origin=None):
+        ''' image may be a pyramid level, scale times smaller than the full resolution image. With
+            origin, it is only the region at origin of the image given to setImageSize '''
+        position = QPointF(-0.5,-0.5) if origin is None else QPointF(origin[0]-0.5,origin[1]-0.5)
+        if image is self._image.array() and scale == self._image.scale() and position == self._image.pos():
+            # same buffer, possibly changed in place
+            self._image.update()
+            return
+        self._image.setArray(image)
+        # scene coordinates stay those of the full resolution image whatever level is shown
+        self._image.setScale(scale)
+        self._image.setPos(position)
+        if origin is not None:
+            return
+        # a whole image, the overlays were those of the previous one
+        for key in self._overlays:
+            self._setOverlay(key,[])
+        old = self._imageRect
+        self._imageRect = self._image.sceneBoundingRect()
+        if not self._zoomed or not self._sameSize(old):
+            self._fit()
+
+    def _sameSize(self,rect):
+        # a level drops up to scale-1 pixels at the right and bottom edges
+        slack = self._image.scale()
+        return abs(self._imageRect.width() - rect.width()) < slack and abs(self._imageRect.height() - rect.height()) < slack
+
+    def visibleBox(self):
+        ''' the part of the scene in view, (x1,y1,x2,y2) in image coordinates '''
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        return rect.left(),rect.top(),rect.right(),rect.bottom()
+
+    def imagePixelsPerScreenPixel(self,width,height):
+        ratio = self.devicePixelRatioF()
+        if self._zoomed:
+            return 1/(self.transform().m11()*ratio)
+        viewport = self.viewport()
+        return max(width/max(1,viewport.width()*ratio),height/max(1,viewport.height()*ratio))
+
+    def _fit(self):
+        self.setSceneRect(self._imageRect)
+        self.fitInView(self._imageRect,Qt.KeepAspectRatio)
+        self._zoomed = False
+
+    def _setOverlay(self,key,items):
+        for item in self._overlays[key]:
+            self.scene().removeItem(item)
+        for item in items:
+            self.scene().addItem(item)
+        self._overlays[key] = items
+
+    def _paths(self,shapes,addShape,width,z):
+        # one path item per color however many shapes there are
+        paths = {}
+        for shape,color in shapes:
+            path = paths.setdefault(tuple(color),QPainterPath())
+            addShape(path,shape)
+        items = []
+        for color,path in paths.items():
+            item = QtWidgets.QGraphicsPathItem(path)
+            item.setPen(QPen(QColor(*color),width,Qt.SolidLine,Qt.RoundCap,Qt.RoundJoin))
+            item.setZValue(z)
+            items.append(item)
+        return items
+
+    def setPolygons(self,polygons):
+        ''' polygons is a list of (points,color) drawn as shape borders '''
+        def addPolygon(path,points):
+            path.addPolygon(_polygon(points))
+            path.closeSubpath()
+        self._setOverlay("polygons",self._paths(polygons,addPolygon,BORDER_WIDTH,1))
+
+    def setBoxes(self,boxes):
+        ''' boxes is a list of ((x1,y1,x2,y2),color) '''
+        def addBox(path,bounds):
+            x1,y1,x2,y2 = bounds
+            path.addRect(QRectF(x1,y1,x2-x1,y2-y1))
+        self._setOverlay("boxes",self._paths(boxes,addBox,BOX_WIDTH,1))
+
+    def setFilling(self,points):
+        if points is None:
+            self._setOverlay("filling",[])
+            return
+        item = QtWidgets.QGraphicsPolygonItem(_polygon(points))
+        item.setPen(QPen(Qt.NoPen))
+        item.setBrush(QBrush(QColor(*FILLING_COLOR)))
+        item.setZValue(2)
+        self._setOverlay("filling",[item])
+
+    def resizeEvent(self,event):
+        super(CanvasWidget,self).resizeEvent(event)
+        if not self._zoomed:
+            self._fit()
+        self.viewChanged.emit()
+
+    def scrollContentsBy(self,dx,dy):
+        super(CanvasWidget,self).scrollContentsBy(dx,dy)
+        self.viewChanged.emit()
+
+    def wheelEvent(self,event):
+        step = ZOOM_STEP if event.angleDelta().y() > 0 else 1/ZOOM_STEP
+        self.scale(step,step)
+        self._zoomed = True
+        self.viewChanged.emit()
+
+    def mouseDoubleClickEvent(self,event):
+        self._fit()
+        self.viewChanged.emit()
+
+    def mousePressEvent(self,event):
+        if self._connected and event.button() == Qt.LeftButton:
+            start = self.mapToScene(event.pos())
+            self._lassoPoints = [start]
+            self._lassoPath = QPainterPath(start)
+            self._lassoLine.setVisible(True)
+            return
+        super(CanvasWidget,self).mousePressEvent(event)
+
+    def mouseMoveEvent(self,event):
+        if self._lassoPoints is not None:
+            point = self.mapToScene(event.pos())
+            self._lassoPoints.append(point)
+            self._lassoPath.lineTo(point)
+            self._lassoLine.setPath(self._lassoPath)
+            return
+        super(CanvasWidget,self).mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self,event):
+        if self._lassoPoints is not None and event.button() == Qt.LeftButton:
+            points = [(p.x(),p.y()) for p in self._lassoPoints]
+            self.clear()
+            # the same list of (x,y) image coordinates as LassoWidget
+            self.selectionChanged.emit(points)
+            return
+        super(CanvasWidget,self).mouseReleaseEvent(event)
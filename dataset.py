@@ -2,33 +2,162 @@
 import json
 import os
 import random
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import numpy as np
 from PIL import Image
 import cv2
-VALID_FORMAT = ('.BMP', '.GIF', '.JPG', '.JPEG', '.PNG', '.PBM', '.PGM', '.PPM', '.TIFF', '.XBM')  # Image formats supported by Qt
+VALID_FORMAT = ('.BMP', '.GIF', '.JPG', '.JPEG', '.PNG', '.PBM', '.PGM', '.PPM', '.TIF', '.TIFF', '.XBM')  # Image formats supported by Qt
 VALID_VIDEO_FORMAT = (".MP4",".MOV")
 import matplotlib.pyplot as plt
 from utils import notify
+from videoindex import openKeyframeReader
+from framestore import FrameStore
+from tiledimage import TiledImage, isTiledImage
+from manifest import Manifest
+from autosave import AutoSaver
+import serializer
 import imageio
 
 # starting from 1 to eliminate any chance of having 0,0,0
 
 create_random_color = lambda : (random.randint(1, 255), random.randint(1, 255), random.randint(1, 255))
 COLORS = [create_random_color() for i in range(1000)]
-get_color = lambda o: COLORS[o]
+
+def get_color(o):
+    # grows the color table on demand so the number of objects isn't capped
+    while o >= len(COLORS):
+        COLORS.append(create_random_color())
+    return COLORS[o]
+
+# max distance in pixels between a lasso stroke and its simplified polygon, 0 keeps every point
+SIMPLIFY_TOLERANCE = 1.0
+# journal size in bytes past which a save compacts it into the annotation file
+JOURNAL_COMPACT_SIZE = 1024**2
+# items opened ahead on each side of the current one, and the memory they may take
+PREFETCH_ITEMS = 2
+PREFETCH_BUDGET = 2*1024**3 # bytes
+# memory kept by items opened earlier, see ItemCache
+ITEM_CACHE_BUDGET = 4*1024**3 # bytes
+# longest side of the thumbnails shown while an item loads, and how many are kept
+THUMBNAIL_SIZE = 256
+THUMBNAIL_CACHE = 2000
+# halvings of the display resolution pyramid, level 0 is the image itself
+PYRAMID_LEVELS = 6
+# levels a JPEG decoder can skip to while decoding, down to 1/8 of the resolution
+JPEG_DRAFT_LEVELS = 3
+# side in pixels of the grid cells used to index shape bounds
+SHAPE_INDEX_CELL = 256
+
+# bytes of decoded RGB frames kept per opened video, about 20 frames of 4K
+VIDEO_CACHE_BUDGET = 512*1024**2
+# frames decoded ahead of and behind the current one at the current jump
+VIDEO_PREFETCH_DEPTH = 4
+# workers decoding and encoding frames in Dataset.sampleFrames
+SAMPLE_WORKERS = max(1,(os.cpu_count() or 1) - 1)
+# gaps between sampled frames up to this many frames are decoded through, longer ones are seeked over
+SAMPLE_GRAB_LIMIT = 64
 
 
 def exists(path):
     return os.path.exists(path)
 
+def simplifyPolygon(points,tolerance=SIMPLIFY_TOLERANCE):
+    # Douglas-Peucker through OpenCV, never collapses below a triangle
+    polygon = np.asarray(points,dtype=np.float32).reshape((-1,1,2))
+    if tolerance <= 0 or len(polygon) <= 3:
+        return polygon.reshape(-1,2)
+    simplified = cv2.approxPolyDP(polygon,tolerance,True)
+    if len(simplified) < 3:
+        return polygon.reshape(-1,2)
+    return simplified.reshape(-1,2)
+
+def pyramidLevel(ratio):
+    ''' the coarsest level still giving a screen pixel at least one pixel, ratio being image pixels per screen pixel '''
+    level = 0
+    while level < PYRAMID_LEVELS and ratio >= 2**(level+1):
+        level += 1
+    return level
+
+def _downscale(array,level):
+    # area average over whole 2**level blocks, partial blocks at the right and bottom edges are dropped
+    scale = 2**level
+    height,width = array.shape[0]//scale, array.shape[1]//scale
+    return cv2.resize(array[:height*scale,:width*scale],(width,height),interpolation=cv2.INTER_AREA)
+
+def frameHash(frame):
+    # 64 bit difference hash of a 9x8 grayscale thumbnail
+    gray = cv2.cvtColor(frame,cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray,(9,8),interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:,1:] > small[:,:-1])
+
+def hashDistance(h1,h2):
+    return int(np.unpackbits(np.bitwise_xor(h1,h2)).sum())
+
+def _decodeFrames(cap,frameNums):
+    # yields (frameNum,RGB frame) of sorted frame numbers, only moving the capture forward
+    position = -1
+    for frameNum in frameNums:
+        if position < 0 or frameNum - position > SAMPLE_GRAB_LIMIT:
+            cap.set(cv2.CAP_PROP_POS_FRAMES,frameNum)
+        else:
+            for _ in range(frameNum - position):
+                cap.grab()
+        ret, frame = cap.read()
+        position = frameNum + 1
+        if not ret:
+            position = -1
+            continue
+        yield frameNum, cv2.cvtColor(frame.astype(np.uint8),cv2.COLOR_BGRA2RGB)
+
+def _sampleChunk(videoPath,frames,outputs,onFrame=None):
+    # each worker owns its capture and a contiguous range of frames, so every frame is decoded once
+    cap = cv2.VideoCapture(videoPath)
+    written = []
+    try:
+        for frameNum,frame in _decodeFrames(cap,frames):
+            imageio.imwrite(outputs[frameNum],frame)
+            written.append(frameNum)
+            if onFrame is not None:
+                onFrame()
+    finally:
+        cap.release()
+    return written
+
 class Video:
-    def __init__(self,path):
+    def __init__(self,path,cacheBudget=VIDEO_CACHE_BUDGET,prefetchDepth=VIDEO_PREFETCH_DEPTH,useKeyframeIndex=True):
         self._path = path
         self._counter = -1
         self._numOfFrames = -1
         self._fps = -1
+        self._width = 0
+        self._height = 0
         self._open = False
         self._cap = None
+        # index of the frame the capture decoded last, -1 when unknown
+        self._lastDecoded = -1
+        self._cacheBudget = cacheBudget
+        self._cache = OrderedDict()
+        self._cacheBytes = 0
+        # bytes of one decoded frame, known after the first decode
+        self._frameBytes = 0
+        # guards the capture and the cache against the prefetch worker
+        self._lock = threading.Lock()
+        self._prefetchDepth = prefetchDepth
+        self._prefetchThread = None
+        self._prefetchCancel = None
+        self._prefetchKey = None
+        self._jump = 1
+        self._direction = 1
+        self._useKeyframeIndex = useKeyframeIndex
+        # frame accurate seeks through PyAV, see videoindex; built off the GUI thread by _indexThread
+        self._reader = None
+        self._indexThread = None
+        # decoded frames served from a FrameStore memory map, see storeFrames
+        self._frames = None
+        self._framesScale = 1.0
     
     def open(self):
         self._cap = cv2.VideoCapture(self._path)
@@ -39,21 +168,202 @@ class Video:
 
         self._numOfFrames = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
         self._fps = int(self._cap.get(cv2.CAP_PROP_FPS))
+        self._width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self._height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         self._counter = 0
+        self._lastDecoded = -1
+        self._cache.clear()
+        self._cacheBytes = 0
+        self._frameBytes = 0
+        self._jump = 1
+        self._direction = 1
         self._open = True
+        if self._useKeyframeIndex:
+            # indexing demuxes the whole file, frames are seeked through OpenCV until it is done
+            self._indexThread = threading.Thread(target=self._loadReader,daemon=True)
+            self._indexThread.start()
 
         return True
-    
-    def read(self):
-        self._cap.set(1,self._counter)
-        ret, frame = self._cap.read()
+
+    def _loadReader(self):
+        reader = openKeyframeReader(self._path)
+        if reader is None:
+            return
+        with self._lock:
+            # not closed, nor closed and opened again, while indexing
+            if self._open and self._indexThread is threading.current_thread():
+                self._reader = reader
+                # frames seeked to through OpenCV can be off by a few, the reader's are exact
+                self._cache.clear()
+                self._cacheBytes = 0
+                return
+        reader.close()
+
+    def _decode(self,frameNum):
+        if self._reader is not None:
+            ret, frame = self._reader.read(frameNum)
+        else:
+            # seeking forces a GOP re-decode, only do it when not reading sequentially
+            if frameNum != self._lastDecoded + 1:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES,frameNum)
+            ret, frame = self._cap.read()
+            if ret:
+                frame = cv2.cvtColor(frame.astype(np.uint8),cv2.COLOR_BGRA2RGB)
 
         if not ret:
+            self._lastDecoded = -1
             return False, None
 
-        frame = frame.astype(np.uint8)
-        frame = cv2.cvtColor(frame,cv2.COLOR_BGRA2RGB)
+        self._lastDecoded = frameNum
+        # frames are shared through the cache
+        frame.flags.writeable = False
+        return ret, frame
+
+    def _cacheFrame(self,frameNum,frame):
+        self._frameBytes = frame.nbytes
+        if frameNum in self._cache:
+            self._cacheBytes -= self._cache[frameNum].nbytes
+        self._cache[frameNum] = frame
+        self._cache.move_to_end(frameNum)
+        self._cacheBytes += frame.nbytes
+        while self._cacheBytes > self._cacheBudget and self._cache:
+            _,evicted = self._cache.popitem(last=False)
+            self._cacheBytes -= evicted.nbytes
+
+    def _readFrame(self,frameNum):
+        with self._lock:
+            if frameNum in self._cache:
+                self._cache.move_to_end(frameNum)
+                return True, self._cache[frameNum]
+
+            ret, frame = self._decode(frameNum)
+            if ret:
+                self._cacheFrame(frameNum,frame)
+            return ret, frame
+
+    def _inStore(self,frameNum,fullResolution=False):
+        if self._frames is None or not self._frames.contains(frameNum):
+            return False
+        return not fullResolution or self._framesScale == 1.0
+
+    def read(self,fullResolution=False):
+        if self._inStore(self._counter,fullResolution):
+            return True, self._frames.get(self._counter)
+
+        # the position moved, don't let the worker hold the capture any longer
+        if self._prefetchCancel is not None and self._prefetchKey != (self._counter,self._jump,self._direction):
+            self._prefetchCancel.set()
+        ret, frame = self._readFrame(self._counter)
+        self.prefetch()
         return ret, frame
+
+    def _iterFrames(self,start,end,size=None,progress=None,cancel=None):
+        # decoders of their own, the video stays readable while a store is built
+        reader = openKeyframeReader(self._path) if self._useKeyframeIndex else None
+        cap = None
+        if reader is None:
+            cap = cv2.VideoCapture(self._path)
+            cap.set(cv2.CAP_PROP_POS_FRAMES,start)
+        try:
+            for frameNum in range(start,end):
+                if cancel is not None and cancel.is_set():
+                    return
+                if reader is not None:
+                    ret, frame = reader.read(frameNum)
+                else:
+                    ret, frame = cap.read()
+                    if ret:
+                        frame = cv2.cvtColor(frame.astype(np.uint8),cv2.COLOR_BGRA2RGB)
+                if not ret:
+                    return
+                if size is not None:
+                    frame = cv2.resize(frame,size,interpolation=cv2.INTER_AREA)
+                if progress is not None:
+                    progress(frameNum-start+1,end-start)
+                yield frame
+        finally:
+            if reader is not None:
+                reader.close()
+            if cap is not None:
+                cap.release()
+
+    def storeFrames(self,store,start=0,end=None,scale=1.0,progress=None,cancel=None):
+        ''' serves [start,end) from store, decoding the frames into it unless they were stored before.
+            Meant to run off the GUI thread: progress(done,total) is called from it, and setting the
+            cancel event stops decoding and keeps nothing. '''
+        if end is None or end > self._numOfFrames:
+            end = self._numOfFrames
+        start = max(0,start)
+        if start >= end:
+            return False
+
+        frames = store.open(self._path,start,end,scale)
+        if frames is None:
+            width, height = self._width, self._height
+            size = None
+            if scale != 1.0:
+                width, height = max(1,int(width*scale)), max(1,int(height*scale))
+                size = (width,height)
+            frames = store.build(self._path,start,end,scale,height,width,self._iterFrames(start,end,size,progress,cancel),cancel)
+        if frames is None:
+            return False
+
+        with self._lock:
+            # closed while the store was built
+            if not self._open:
+                frames.close()
+                return False
+            if self._frames is not None:
+                self._frames.close()
+            self._frames = frames
+            self._framesScale = scale
+        return True
+
+    def _prefetchTargets(self):
+        ahead = [self._counter + i*self._direction*self._jump for i in range(1,self._prefetchDepth+1)]
+        behind = [self._counter - i*self._direction*self._jump for i in range(1,self._prefetchDepth+1)]
+        # frames in the scrubbing direction first, they are the likely next request
+        targets = [f for f in ahead + behind if 0 <= f < self._numOfFrames and not self._inStore(f)]
+        if self._frameBytes > 0:
+            # no more than the cache holds next to the current frame, or they would evict each other
+            targets = targets[:max(0,self._cacheBudget//self._frameBytes - 1)]
+        return targets
+
+    def _prefetchWorker(self,targets,cancel):
+        for frameNum in targets:
+            if cancel.is_set():
+                return
+            with self._lock:
+                if cancel.is_set() or not self._open:
+                    return
+                if frameNum in self._cache:
+                    continue
+                ret, frame = self._decode(frameNum)
+                if ret:
+                    self._cacheFrame(frameNum,frame)
+
+    def prefetch(self):
+        if self._prefetchDepth <= 0 or not self._open:
+            return
+        key = (self._counter,self._jump,self._direction)
+        if key == self._prefetchKey and self._prefetchThread is not None and self._prefetchThread.is_alive():
+            return
+        self.stopPrefetch()
+        self._prefetchKey = key
+        self._prefetchCancel = threading.Event()
+        self._prefetchThread = threading.Thread(target=self._prefetchWorker,
+                                                args=(self._prefetchTargets(),self._prefetchCancel),
+                                                daemon=True)
+        self._prefetchThread.start()
+
+    def stopPrefetch(self):
+        if self._prefetchCancel is not None:
+            self._prefetchCancel.set()
+        if self._prefetchThread is not None:
+            self._prefetchThread.join()
+        self._prefetchThread = None
+        self._prefetchCancel = None
+        self._prefetchKey = None
     
     def goto(self,frameNum):
         if frameNum >= self._numOfFrames and frameNum < 0:
@@ -68,6 +378,8 @@ class Video:
         
         if self._counter + jump < self._numOfFrames:
             self._counter += jump
+            self._jump = jump
+            self._direction = 1
             return self.read()
         else:
             notify(f"No more frames with current jump {jump}","error")
@@ -79,18 +391,35 @@ class Video:
         
         if self._counter - jump >= 0:
             self._counter -= jump
+            self._jump = jump
+            self._direction = -1
             return self.read()
         else:
             notify(f"No more frames with current jump {jump}","error")
             return False,None
 
     def close(self):
-        self._cap.release() 
-        self._counter = -1
-        self._numOfFrames = -1
-        self._fps = -1
-        self._open = False
-        self._cap = None
+        self.stopPrefetch()
+        # a store being built in the background checks _open before attaching itself
+        with self._lock:
+            self._cap.release() 
+            self._counter = -1
+            self._numOfFrames = -1
+            self._fps = -1
+            self._open = False
+            self._cap = None
+            self._lastDecoded = -1
+            self._cache.clear()
+            self._cacheBytes = 0
+            if self._reader is not None:
+                self._reader.close()
+            self._reader = None
+            # an index still being built is dropped by _loadReader
+            self._indexThread = None
+            if self._frames is not None:
+                self._frames.close()
+            self._frames = None
+            self._framesScale = 1.0
         return True
     
     def isOpen(self):
@@ -98,67 +427,262 @@ class Video:
     
     def numOfFrames(self):
         return self._numOfFrames
+
+    def size(self):
+        return self._width, self._height
     
     def currentFrame(self):
         return self._counter
 
+    def path(self):
+        return self._path
+
     @classmethod
     def create(self,path):
         return Video(path)
 
 class DatasetObject:
-    def __init__(self,name,color):
+    def __init__(self,name,color,index):
         self._name = name 
         self._color = color
+        self._index = index # value of the object in the label map, 0 is background
 
     def color(self):
         return self._color
 
+    def index(self):
+        return self._index
+
     def __str__(self):
         return self._name, self._color
 
+class ShapeIndex:
+    ''' uniform grid over shape bounding boxes '''
+    def __init__(self,cellSize=SHAPE_INDEX_CELL):
+        self._cellSize = cellSize
+        self._cells = {}
+        self._bounds = {}
+
+    def _cells_of(self,box):
+        x1,y1,x2,y2 = box
+        c = self._cellSize
+        for cx in range(int(x1)//c,int(x2)//c+1):
+            for cy in range(int(y1)//c,int(y2)//c+1):
+                yield cx,cy
+
+    def insert(self,key,box):
+        self._bounds[key] = box
+        for cell in self._cells_of(box):
+            self._cells.setdefault(cell,set()).add(key)
+
+    def remove(self,key):
+        box = self._bounds.pop(key)
+        for cell in self._cells_of(box):
+            self._cells[cell].discard(key)
+            if len(self._cells[cell]) == 0:
+                del self._cells[cell]
+
+    def bounds(self,key):
+        return self._bounds[key]
+
+    def query(self,box):
+        x1,y1,x2,y2 = box
+        candidates = set()
+        for cell in self._cells_of(box):
+            candidates |= self._cells.get(cell,set())
+        hits = []
+        for key in candidates:
+            bx1,by1,bx2,by2 = self._bounds[key]
+            if bx1 <= x2 and bx2 >= x1 and by1 <= y2 and by2 >= y1:
+                hits.append(key)
+        return sorted(hits)
+
+# labelme shape types, stored as their position in this tuple
+SHAPE_TYPES = ("polygon","rectangle","circle","line","point","linestrip")
+
+class ShapeStore:
+    ''' shape points packed in one float32 buffer with per-shape columns, rows are never reused '''
+    def __init__(self,capacity=64,coordCapacity=4096):
+        self._coords = np.empty((coordCapacity,2),dtype=np.float32)
+        self._used = 0 # coordinate rows written, including those of deleted shapes
+        self._live = 0 # coordinate rows of live shapes
+        self._offsets = np.empty(capacity,dtype=np.int64)
+        self._lengths = np.empty(capacity,dtype=np.int32)
+        self._objects = np.empty(capacity,dtype=np.int32)
+        self._types = np.empty(capacity,dtype=np.uint8)
+        self._labels = np.empty(capacity,dtype=np.int32)
+        self._bounds = np.empty((capacity,4),dtype=np.float32)
+        self._alive = np.zeros(capacity,dtype=bool)
+        self._count = 0
+        self._labelNames = []
+        self._labelCodes = {}
+
+    def _growRows(self):
+        capacity = 2*len(self._offsets)
+        for name in ("_offsets","_lengths","_objects","_types","_labels","_bounds"):
+            old = getattr(self,name)
+            new = np.empty((capacity,) + old.shape[1:],dtype=old.dtype)
+            new[:self._count] = old[:self._count]
+            setattr(self,name,new)
+        alive = np.zeros(capacity,dtype=bool)
+        alive[:self._count] = self._alive[:self._count]
+        self._alive = alive
+
+    def _reserveCoords(self,n):
+        if self._used + n <= len(self._coords):
+            return
+        # drop the points of deleted shapes before growing
+        if self._used > 2*self._live:
+            self.compact()
+        if self._used + n > len(self._coords):
+            coords = np.empty((max(2*len(self._coords),self._used + n),2),dtype=np.float32)
+            coords[:self._used] = self._coords[:self._used]
+            self._coords = coords
+
+    def compact(self):
+        rows = self.rows()
+        coords = np.empty((max(len(self._coords)//2,self._live,1),2),dtype=np.float32)
+        offset = 0
+        for row in rows:
+            o,l = self._offsets[row],self._lengths[row]
+            coords[offset:offset+l] = self._coords[o:o+l]
+            self._offsets[row] = offset
+            offset += l
+        self._coords = coords
+        self._used = offset
+
+    def add(self,points,objectIndex,shapeType,label):
+        points = np.asarray(points,dtype=np.float32).reshape(-1,2)
+        if self._count == len(self._offsets):
+            self._growRows()
+        self._reserveCoords(len(points))
+        if label not in self._labelCodes:
+            self._labelCodes[label] = len(self._labelNames)
+            self._labelNames.append(label)
+
+        row = self._count
+        self._coords[self._used:self._used+len(points)] = points
+        self._offsets[row] = self._used
+        self._lengths[row] = len(points)
+        self._objects[row] = objectIndex
+        self._types[row] = SHAPE_TYPES.index(shapeType)
+        self._labels[row] = self._labelCodes[label]
+        self._bounds[row] = points.min(axis=0).tolist() + points.max(axis=0).tolist()
+        self._alive[row] = True
+        self._used += len(points)
+        self._live += len(points)
+        self._count += 1
+        return row
+
+    def remove(self,row):
+        self._alive[row] = False
+        self._live -= int(self._lengths[row])
+
+    def rows(self):
+        return np.flatnonzero(self._alive[:self._count])
+
+    def count(self):
+        return self._count
+
+    def points(self,row):
+        o = self._offsets[row]
+        return self._coords[o:o+self._lengths[row]]
+
+    def polygon(self,row):
+        return self.points(row).astype(np.int32).reshape((-1,1,2))
+
+    def bounds(self,row):
+        return tuple(self._bounds[row].tolist())
+
+    def objectIndex(self,row):
+        return int(self._objects[row])
+
+    def shapeType(self,row):
+        return SHAPE_TYPES[self._types[row]]
+
+    def label(self,row):
+        return self._labelNames[self._labels[row]]
+
+    def filterType(self,rows,shapeType):
+        rows = np.asarray(rows,dtype=np.int64)
+        return rows[self._types[rows] == SHAPE_TYPES.index(shapeType)].tolist()
+
+    def nbytes(self):
+        return (self._coords.nbytes + self._offsets.nbytes + self._lengths.nbytes + self._objects.nbytes
+                + self._types.nbytes + self._labels.nbytes + self._bounds.nbytes + self._alive.nbytes)
+
 class Annotation:
     def __init__(self,path):
         self._path = path
-        self._shapes = {}
+        self._store = ShapeStore()
         self._objectShapes = {}
         self._objects = {}
-        self._shapeCounter = 0 # act as counter for shapes
+        self._objectsByIndex = [None]
+        self._palette = None
+        self._index = ShapeIndex()
+        self._objectBounds = {} # union of the shape bounds of every object with shapes
+        # held while shapes change or are serialized, saving can run in the autosave thread
+        self._lock = threading.Lock()
+        # append-only log of edits made since the annotation file was written, see openJournal;
+        # the file is only created by the first edit logged
+        self._journaling = False
+        self._journal = None
+        self._journalGeneration = 0
+        self._journalRecords = 0
+        # (position in the file, label, reason) of shapes fromJson could not load
+        self._skipped = []
 
     def addShape(self,label,shapeStr,points,objectId):
-        
-        if shapeStr == "rectangle":
-            points = [[min(points[0][0],points[1][0]),min(points[0][1],points[1][1])],
-                        [max(points[0][0],points[1][0]),max(points[0][1],points[1][1])]],    
-        shape = {
-                "label": label,
-                "points": points,
-                "group_id": objectId,
-                "shape_type":shapeStr,
-                "flags": {}
-        }
+        with self._lock:
+            if shapeStr == "rectangle":
+                points = [[min(points[0][0],points[1][0]),min(points[0][1],points[1][1])],
+                            [max(points[0][0],points[1][0]),max(points[0][1],points[1][1])]]
 
-        self._shapes[self._shapeCounter] = shape
-        if objectId in self._objectShapes:
-            self._objectShapes[objectId].append(self._shapeCounter)
-        else:
-            self._objectShapes[objectId] = [self._shapeCounter]
-        
-        
-        # will not be written or used. Just to aid in temprorly created objects without shapes
-        # mainly used by objectNames()
-        if objectId not in self._objects:
-            self._objects[objectId] = DatasetObject(objectId,get_color(len(self._objects)))
-        
-        self._shapeCounter += 1
+            # will not be written or used. Just to aid in temprorly created objects without shapes
+            # mainly used by objectNames()
+            if objectId not in self._objects:
+                self._objects[objectId] = DatasetObject(objectId,get_color(len(self._objects)),len(self._objectsByIndex))
+                self._objectsByIndex.append(objectId)
+                self._palette = None
+
+            index = self._store.add(points,self.getObjectIndex(objectId),shapeStr,label)
+            bounds = self._store.bounds(index)
+            self._index.insert(index,bounds)
+            if objectId in self._objectBounds:
+                x1,y1,x2,y2 = self._objectBounds[objectId]
+                self._objectBounds[objectId] = (min(x1,bounds[0]),min(y1,bounds[1]),max(x2,bounds[2]),max(y2,bounds[3]))
+            else:
+                self._objectBounds[objectId] = bounds
+            if objectId in self._objectShapes:
+                self._objectShapes[objectId].append(index)
+            else:
+                self._objectShapes[objectId] = [index]
+
+            if self._journaling:
+                points = self._store.points(index).astype(np.float64).round(serializer.get().precision()).tolist()
+                self._log({"op": "add","label": label,"shape_type": shapeStr,"points": points,"group_id": objectId})
         
     def deleteShape(self,objectId,contourId):
-        index = self._objectShapes[objectId][contourId]
-        self._objectShapes[objectId].pop(contourId)
-        self._shapes.pop(index)      
+        with self._lock:
+            index = self._objectShapes[objectId][contourId]
+            self._objectShapes[objectId].pop(contourId)
+            bounds = self._store.bounds(index)
+            self._store.remove(index)
+            self._index.remove(index)
 
-    def shapes(self):
-        return list(self._shapes.values())
+            # the object box only shrinks when the deleted shape was on one of its edges
+            remaining = self._objectShapes[objectId]
+            if len(remaining) == 0:
+                self._objectBounds.pop(objectId,None)
+            elif any(b == o for b,o in zip(bounds,self._objectBounds[objectId])):
+                allBounds = np.array([self._store.bounds(i) for i in remaining])
+                self._objectBounds[objectId] = tuple(allBounds[:,:2].min(axis=0).tolist() + allBounds[:,2:].max(axis=0).tolist())
+
+            if self._journaling:
+                self._log({"op": "delete","group_id": objectId,"contour": contourId})
+
+    def shapes(self,precision=None):
+        return [self.getShape(i,precision) for i in self._store.rows()]
     
     def getObjectShapes(self,oId=None,shapeType=None):
         if oId is None:
@@ -168,65 +692,257 @@ class Annotation:
             if shapeType is None:
                 return self._objectShapes[oId]
             else:
-                return [k for k in self._objectShapes[oId] if self._shapes[k]["shape_type"] == shapeType]
+                return self._store.filterType(self._objectShapes[oId],shapeType)
 
         return []
     
-    def getShape(self,index):
-        return self._shapes[index]
+    def getShape(self,index,precision=None):
+        # labelme style dict, built on demand
+        if precision is None:
+            precision = serializer.get().precision()
+        points = self._store.points(index).astype(np.float64).round(precision)
+        return {
+            "label": self._store.label(index),
+            "points": points.tolist(),
+            "group_id": self.getShapeObject(index),
+            "shape_type": self._store.shapeType(index),
+            "flags": {}
+        }
 
-    def save(self,imgPath,width,height,boundingBox=False):
+    def getShapePoints(self,index):
+        return self._store.points(index)
+
+    def getShapeObject(self,index):
+        return self._objectsByIndex[self._store.objectIndex(index)]
+
+    def getShapePolygon(self,index):
+        return self._store.polygon(index)
+
+    def getShapeBounds(self,index):
+        return self._store.bounds(index)
+
+    def getObjectBounds(self,objectId=None):
+        if objectId is None:
+            return self._objectBounds
+        return self._objectBounds.get(objectId)
+
+    def shapesInBox(self,box):
+        # shape indices whose bounds intersect box, in drawing order
+        return self._index.query(box)
+
+    def nbytes(self):
+        return self._store.nbytes()
+
+    def toDict(self,imgPath,width,height,boundingBox=False,precision=None):
+        with self._lock:
+            return self._toDict(imgPath,width,height,boundingBox,precision)
+
+    def _toDict(self,imgPath,width,height,boundingBox,precision=None):
+        if precision is None:
+            precision = serializer.get().precision()
         ann = {
             "version": "4.5.6",
             "flags": {},
-            "shapes": list(self._shapes.values()),
+            "shapes": self.shapes(precision),
             "imagePath": imgPath,
             "imageData":None,
             "imageHeight": height,
             "imageWidth": width
         }
         if boundingBox:
-            for o,s in self._objectShapes.items():
-                if len(s) == 0:
-                    continue
-                s1 = self._shapes[s[0]]
-                points = s1["points"]
-                polygon = np.array(points)
-                x1,y1,x2,y2 = polygon[:,0].min(),polygon[:,1].min(),polygon[:,0].max(),polygon[:,1].max()
-                for s2 in s[1:]:
-                    points = self._shapes[s2]["points"]
-                    polygon = np.array(points)
-                    x1,y1 = min(x1,polygon[:,0].min()),min(y1,polygon[:,1].min())
-                    x2,y2 = max(x2,polygon[:,0].max()),max(y2,polygon[:,1].max())
+            for o,bounds in self._objectBounds.items():
+                s = self._objectShapes[o]
+                x1,y1,x2,y2 = [round(b,precision) for b in bounds]
                 bs = {
-                    "label": s1["label"],
+                    "label": self._store.label(s[0]),
                     "points": [[x1,y1],[x2,y2]],
-                    "group_id": s1["group_id"],
+                    "group_id": o,
                     "shape_type":"rectangle",
                     "flags": {}
                 }
                 ann["shapes"].append(bs)
-        
-        with open(self._path,"w") as f:
-            f.write(json.dumps(ann,indent=4))
+        return ann
+
+    def save(self,imgPath,width,height,boundingBox=False):
+        with self._lock:
+            ann = self._toDict(imgPath,width,height,boundingBox)
+            if self._journaling:
+                # edits made after this snapshot go to a journal of the next generation, created
+                # by the next edit; the old one is only removed once the snapshot is on disk
+                if self._journal is not None:
+                    self._journal.close()
+                    self._journal = None
+                if exists(self.journalPath()):
+                    if exists(f"{self.journalPath()}.old"):
+                        # left by a write that failed, its edits are not in the annotation file either
+                        with open(self.journalPath()) as f:
+                            records = f.readlines()[1:]
+                        with open(f"{self.journalPath()}.old","a") as f:
+                            f.writelines(records)
+                        os.remove(self.journalPath())
+                    else:
+                        os.replace(self.journalPath(),f"{self.journalPath()}.old")
+                self._journalGeneration += 1
+                records = self._journalRecords
+                self._journalRecords = 0
+                ann["journalGeneration"] = self._journalGeneration
+
+        # written next to the target and renamed so a crash never leaves a truncated file
+        tmpPath = f"{self._path}.tmp"
+        try:
+            serializer.get().dump(ann,tmpPath)
+            os.replace(tmpPath,self._path)
+        except Exception:
+            if self._journaling:
+                with self._lock:
+                    self._journalRecords += records
+            raise
+        if os.path.exists(f"{self.journalPath()}.old"):
+            os.remove(f"{self.journalPath()}.old")
+
+    def journalPath(self):
+        return f"{os.path.splitext(self._path)[0]}.journal"
+
+    def _log(self,record):
+        if self._journal is None:
+            self._startJournal()
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+        self._journalRecords += 1
+
+    def _startJournal(self):
+        self._journal = open(self.journalPath(),"w")
+        self._journal.write(json.dumps({"generation": self._journalGeneration}) + "\n")
+        self._journal.flush()
+        self._journalRecords = 0
+
+    def _replay(self,path):
+        with open(path) as f:
+            lines = f.readlines()
+        if len(lines) == 0 or json.loads(lines[0]).get("generation",-1) < self._journalGeneration:
+            return
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last record can be cut short by a crash
+                break
+            if record["op"] == "add":
+                self.addShape(record["label"],record["shape_type"],record["points"],record["group_id"])
+            elif record["op"] == "delete":
+                self.deleteShape(record["group_id"],record["contour"])
+            self._journalRecords += 1
+
+    def openJournal(self):
+        # replays edits not yet compacted into the annotation file, then keeps logging
+        for path in (f"{self.journalPath()}.old",self.journalPath()):
+            if exists(path):
+                self._replay(path)
+        if exists(self.journalPath()):
+            self._journal = open(self.journalPath(),"a")
+        self._journaling = True
+
+    def isJournaling(self):
+        return self._journaling
+
+    def journalSize(self):
+        if self._journal is None:
+            return 0
+        return self._journal.tell()
+
+    def journalRecords(self):
+        # edits, logged or replayed, not yet compacted into the annotation file
+        return self._journalRecords
+
+    def closeJournal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._journaling = False
+
+    def discardJournal(self):
+        # drops the logged edits, the annotation file stays as last saved
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if exists(self.journalPath()):
+                os.remove(self.journalPath())
+            self._journalRecords = 0
 
     def getColor(self,objectId):
         return self._objects[objectId].color()
 
+    def getObjectIndex(self,objectId):
+        return self._objects[objectId].index()
+
+    def getObjectByIndex(self,index):
+        return self._objectsByIndex[index]
+
+    def palette(self):
+        # label map index -> RGB, index 0 is black
+        if self._palette is None:
+            colors = [(0,0,0)] + [self._objects[o].color() for o in self._objectsByIndex[1:]]
+            self._palette = np.array(colors,dtype=np.uint8)
+        return self._palette
+
     def getObjectNames(self):
         return list(self._objects.keys())
 
+    def skippedShapes(self):
+        return self._skipped
+
     @classmethod
-    def fromJson(self,path):
+    def fromJson(self,path,journal=False):
         if exists(path):
-            with open(path) as f:
-                annotationDict = json.load(f)
             annotation = Annotation(path)
-            for s in annotationDict["shapes"]:
-                if s["shape_type"] == "polygon":
-                    annotation.addShape(s["label"],s["shape_type"],s["points"],s["group_id"])     
+            ungrouped = []
+            boxes = []
+            def onShape(s):
+                position = len(annotation._skipped) + annotation._store.count() + len(ungrouped) + len(boxes)
+                label = s.get("label")
+                shapeType = s.get("shape_type") or "polygon"
+                points = s.get("points") or []
+                objectId = s.get("group_id")
+                if shapeType == "rectangle" and isinstance(objectId,str) and objectId in annotation._objects:
+                    # an object box written by save(boundingBox=True), rebuilt from the shapes on the next save
+                    boxes.append(position)
+                elif shapeType != "polygon":
+                    annotation._skipped.append((position,label,f"unsupported shape type {shapeType}"))
+                elif len(points) < 3:
+                    annotation._skipped.append((position,label,f"polygon with {len(points)} points"))
+                elif not isinstance(label,str) or label == "":
+                    annotation._skipped.append((position,label,"missing label"))
+                elif objectId is None:
+                    ungrouped.append((label,points))
+                else:
+                    # labelme proper numbers the groups, this tool names them label_count
+                    if not isinstance(objectId,str):
+                        objectId = f"{label}_{objectId}"
+                    annotation.addShape(label,shapeType,points,objectId)
+
+            # other tools' files can embed megabytes of imageData, stream those past it
+            if os.path.getsize(path) > serializer.STREAMING_SIZE:
+                annotationDict = serializer.StreamingReader(path).read(onShape)
+            else:
+                annotationDict = serializer.get().load(path)
+                for s in annotationDict.get("shapes",[]):
+                    onShape(s)
+
+            # shapes without a group become objects of their own
+            lastCount = {}
+            for o in annotation.getObjectNames():
+                label,_,count = o.rpartition("_")
+                if count.isdigit():
+                    lastCount[label] = max(lastCount.get(label,0),int(count))
+            for label,points in ungrouped:
+                lastCount[label] = lastCount.get(label,0) + 1
+                annotation.addShape(label,"polygon",points,f"{label}_{lastCount[label]}")
+            annotation._journalGeneration = annotationDict.get("journalGeneration",0)
         else:
            annotation = Annotation(path) 
+        if journal:
+            annotation.openJournal()
         return annotation
 
 class DatasetItem:
@@ -236,103 +952,371 @@ class DatasetItem:
         self._imgPath = imgPath
         self._annotationPath = annotationPath
         self._maskPath = maskPath
-        self._img = None
         self._imgArray = None
+        # large tiled TIFFs are read through a TiledImage instead of _imgArray, without label map or composite
+        self._source = None
         self._viewArray = None
         self._annotation = None
-        self._maskColor = None
+        # object index of every pixel covered by a shape or its border, colored through
+        # the annotation palette only when displayed
+        self._labelMap = None
+        self._boundary = None
         self._contourFilling = None
         self._imgbase64 = ""
         self._labelsCount = {}
         self._changed = False
-        
-    def drawContourOnMask(self,points,color):
-        polygon = np.array(points)
-        polygon = polygon.reshape((-1,1,2)).astype(np.int32)
-        self._maskColor = cv2.drawContours(self._maskColor, [polygon], -1, color=color, thickness=5)
+        # composited image() output, only regions listed in _dirty are recomputed
+        self._composite = None
+        self._dirty = []
+        # display pyramid levels, built on first use
+        self._levels = {} # level -> downscaled image
+        self._compositeLevels = {} # level -> (downscaled composite, boxes not yet downscaled)
+        self._fillingBox = None
+        self._fillingPoints = None
+        self._boundingBox = False # whether object boxes are written, also when compacting the journal on close
+        self._stale = False
+        self._thumbnail = None
+        # called after each write of the annotation file, see setOnSaved
+        self._onSaved = None
+
+    def _shapeBox(self,points,margin=0):
+        polygon = np.asarray(points)
+        height,width = self.imageSize()
+        x1 = max(0,int(polygon[:,0].min()) - margin)
+        y1 = max(0,int(polygon[:,1].min()) - margin)
+        x2 = min(width,int(polygon[:,0].max()) + margin + 1)
+        y2 = min(height,int(polygon[:,1].max()) + margin + 1)
+        return x1,y1,x2,y2
+
+    def _invalidate(self,box=None):
+        if self.isTiled():
+            return
+        height,width = self._imgArray.shape[:2]
+        full = (0,0,width,height)
+        if self._dirty and self._dirty[0] == full:
+            return
+        if box is None or box == full:
+            self._dirty = [full]
+        else:
+            self._dirty.append(box)
+
+    def _composeRegion(self,x1,y1,x2,y2):
+        if x1 >= x2 or y1 >= y2:
+            return
+        region = self._composite[y1:y2,x1:x2]
+        region[...] = self._imgArray[y1:y2,x1:x2]
+
+        boundary = self._boundary[y1:y2,x1:x2]
+        region[boundary] = self.annotation().palette()[self._labelMap[y1:y2,x1:x2][boundary]]
+
+        # adds 0.4 of the (0,0,255) filling color with uint8 saturation
+        filling = self._contourFilling[y1:y2,x1:x2]
+        if filling.any():
+            blue = region[...,2]
+            blue[filling] = np.minimum(blue[filling],153) + 102
+
+    def _rasterize(self,points,box,thickness):
+        x1,y1,x2,y2 = box
+        polygon = np.asarray(points).reshape((-1,1,2)).astype(np.int32) - np.array([x1,y1],dtype=np.int32)
+        raster = np.zeros((y2-y1,x2-x1),dtype=np.uint8)
+        cv2.drawContours(raster, [polygon], -1, color=1, thickness=thickness)
+        return raster.view(bool)
+
+    def drawContourOnMask(self,points,objectIndex,clip=None):
+        if self.isTiled():
+            return
+        if objectIndex > np.iinfo(self._labelMap.dtype).max:
+            # int32 rather than uint32 so OpenCV can still draw into it
+            self._labelMap = self._labelMap.astype(np.int32)
+        box = self._shapeBox(points,3)
+        if clip is not None:
+            box = (max(box[0],clip[0]),max(box[1],clip[1]),min(box[2],clip[2]),min(box[3],clip[3]))
+        x1,y1,x2,y2 = box
+        if x1 >= x2 or y1 >= y2:
+            return
+        labels = self._labelMap[y1:y2,x1:x2]
+        boundary = self._boundary[y1:y2,x1:x2]
+
+        # the filling doesn't cover borders drawn earlier, matching the old border-only mask
+        labels[self._rasterize(points,box,cv2.FILLED) & ~boundary] = objectIndex
+        border = self._rasterize(points,box,5)
+        labels[border] = objectIndex
+        boundary |= border
+        self._invalidate(box)
     
     def updateMask(self):
-       self._maskColor = np.zeros_like(self._maskColor)
-       for s in self.annotation().shapes():
-            objectId = s["group_id"]
-            points = s["points"]
-            color = self.annotation().getColor(objectId)
-            self.drawContourOnMask(points,color)
+        # one OpenCV call per shape: rasterizing is bound by the pixels drawn, batching shapes
+        # saved nothing measurable. All fillings go first so they never cover a border, as with
+        # drawContourOnMask
+        if self.isTiled():
+            return
+        annotation = self.annotation()
+        # in drawing order, as drawContourOnMask and the regions draw them
+        indices = sorted(i for idxs in annotation.getObjectShapes().values() for i in idxs)
+        polygons = [annotation.getShapePolygon(i) for i in indices]
+        objectIndices = [annotation.getObjectIndex(annotation.getShapeObject(i)) for i in indices]
+        maxIndex = max(objectIndices + [0])
+        dtype = np.uint16 if maxIndex <= np.iinfo(np.uint16).max else np.int32
+        labels = np.zeros(self._labelMap.shape,dtype=dtype)
 
-    def addShape(self,label,shapeStr,points,objectId):
+        for polygon,objectIndex in zip(polygons,objectIndices):
+            cv2.drawContours(labels, [polygon], -1, color=objectIndex, thickness=cv2.FILLED)
+        for polygon,objectIndex in zip(polygons,objectIndices):
+            cv2.polylines(labels, [polygon], True, color=objectIndex, thickness=5)
+
+        boundary = np.zeros(labels.shape,dtype=np.uint8)
+        if polygons:
+            cv2.polylines(boundary, polygons, True, color=1, thickness=5)
+
+        self._labelMap = labels
+        self._boundary = boundary.view(bool)
+        self._invalidate()
+
+    def addShape(self,label,shapeStr,points,objectId,tolerance=SIMPLIFY_TOLERANCE):
+        if shapeStr == "polygon":
+            points = simplifyPolygon(points,tolerance)
         self.annotation().addShape(label,shapeStr,points,objectId)
-        color = self.annotation().getColor(objectId)
-        self.drawContourOnMask(points,color)
+        self.drawContourOnMask(points,self.annotation().getObjectIndex(objectId))
         self._changed = True
+
+    def objectAt(self,x,y):
+        if self.isTiled():
+            # the topmost shape containing the point
+            annotation = self.annotation()
+            for index in reversed(annotation.shapesInBox((x,y,x,y))):
+                if cv2.pointPolygonTest(annotation.getShapePolygon(index),(float(x),float(y)),False) >= 0:
+                    return annotation.getShapeObject(index)
+            return None
+        index = self._labelMap[int(y),int(x)]
+        if index == 0:
+            return None
+        return self.annotation().getObjectByIndex(index)
     
-    def image(self):
-        image = self._imgArray.copy() 
-        borderMask = np.where(self._maskColor != [0,0,0])
-        fillingMask = np.where(self._contourFilling != [0,0,0])
-        image[borderMask] = self._maskColor[borderMask]
-        if fillingMask[0].shape[0] > 0:
-            filling = (image[fillingMask].astype(float) + 0.4*self._contourFilling[fillingMask].astype(float)).clip(0,255).astype(np.uint8)
-            image[fillingMask] = filling
-        return image
+    def _level(self,level):
+        # no level smaller than a pixel
+        height,width = self.imageSize()
+        while level > 0 and min(height,width) >> level == 0:
+            level -= 1
+        return level
+
+    def imageSize(self):
+        if self.isTiled():
+            return self._source.size()
+        return self._imgArray.shape[:2]
+
+    def isTiled(self):
+        return self._source is not None
+
+    def regionBox(self,box,level=0):
+        ''' box grown to whole 2**level blocks and clipped to the part of the image the level covers '''
+        scale = 2**self._level(level)
+        height,width = self.imageSize()
+        x1,y1,x2,y2 = box
+        x1,y1 = max(0,int(x1))//scale*scale, max(0,int(y1))//scale*scale
+        x2 = min(width//scale*scale,-(-int(np.ceil(x2))//scale)*scale)
+        y2 = min(height//scale*scale,-(-int(np.ceil(y2))//scale)*scale)
+        return x1,y1,max(x1,x2),max(y1,y2)
+
+    def _regionPolygons(self,indices,box,level):
+        # shape polygons in the pixel coordinates of a region at a level
+        origin = np.array(box[:2],dtype=np.float32)
+        scale = 2**level
+        return [((self.annotation().getShapePoints(i) - origin) / scale).astype(np.int32).reshape((-1,1,2)) for i in indices]
+
+    def _regionShapes(self,box):
+        # shapes of the region grouped by object, borders reach 3 pixels outside the shape bounds
+        x1,y1,x2,y2 = box
+        shapes = {}
+        for index in self.annotation().shapesInBox((x1-3,y1-3,x2+3,y2+3)):
+            shapes.setdefault(self.annotation().getShapeObject(index),[]).append(index)
+        return shapes
+
+    def _crop(self,image,box,level):
+        scale = 2**level
+        x1,y1,x2,y2 = box
+        return image[y1//scale:y2//scale,x1//scale:x2//scale]
+
+    def rawRegion(self,box,level=0):
+        ''' the image pixels of box at a level, box is aligned with regionBox first '''
+        level = self._level(level)
+        box = self.regionBox(box,level)
+        if self.isTiled():
+            return self._source.region(box,level)
+        return self._crop(self.rawImage(level),box,level)
+
+    def imageRegion(self,box,level=0):
+        level = self._level(level)
+        box = self.regionBox(box,level)
+        if not self.isTiled():
+            return self._crop(self.image(level),box,level)
+        # the shapes are drawn at the region's resolution, as _composeRegion does at full resolution
+        annotation = self.annotation()
+        region = self._source.region(box,level).copy()
+        thickness = max(1,round(5 / 2**level))
+        for o,indices in self._regionShapes(box).items():
+            cv2.polylines(region,self._regionPolygons(indices,box,level),True,color=annotation.getColor(o),thickness=thickness)
+        if self._fillingPoints is not None:
+            filling = np.zeros(region.shape[:2],dtype=np.uint8)
+            polygon = ((self._fillingPoints - np.array(box[:2],dtype=np.float32)) / 2**level).astype(np.int32).reshape((-1,1,2))
+            cv2.drawContours(filling,[polygon],-1,color=1,thickness=cv2.FILLED)
+            filling = filling.view(bool)
+            blue = region[...,2]
+            blue[filling] = np.minimum(blue[filling],153) + 102
+        return region
+
+    def maskRegion(self,box,level=0):
+        level = self._level(level)
+        box = self.regionBox(box,level)
+        if not self.isTiled():
+            return self._crop(self.maskImage(level),box,level)
+        annotation = self.annotation()
+        x1,y1,x2,y2 = box
+        mask = np.zeros(((y2-y1)//2**level,(x2-x1)//2**level,3),dtype=np.uint8)
+        thickness = max(1,round(5 / 2**level))
+        shapes = self._regionShapes(box)
+        # fillings first so they never cover a border, as in updateMask; one call per shape for the even-odd rule
+        for o,indices in shapes.items():
+            for polygon in self._regionPolygons(indices,box,level):
+                cv2.drawContours(mask,[polygon],-1,color=annotation.getColor(o),thickness=cv2.FILLED)
+        for o,indices in shapes.items():
+            cv2.polylines(mask,self._regionPolygons(indices,box,level),True,color=annotation.getColor(o),thickness=thickness)
+        return mask
+
+    def boundingboxRegion(self,box,level=0):
+        level = self._level(level)
+        box = self.regionBox(box,level)
+        if not self.isTiled():
+            return self._crop(self.boundingboxImage(level),box,level)
+        annotation = self.annotation()
+        img = self._source.region(box,level).copy()
+        bx1,by1,bx2,by2 = box
+        scale = 2**level
+        rectangles = {}
+        for o,bounds in annotation.getObjectBounds().items():
+            x1,y1,x2,y2 = bounds
+            if x1 > bx2 or x2 < bx1 or y1 > by2 or y2 < by1:
+                continue
+            x1,y1,x2,y2 = [int(b) for b in ((x1-bx1)/scale,(y1-by1)/scale,(x2-bx1)/scale,(y2-by1)/scale)]
+            rectangle = np.array([[x1,y1],[x2,y1],[x2,y2],[x1,y2]],dtype=np.int32).reshape((-1,1,2))
+            rectangles.setdefault(tuple(annotation.getColor(o)),[]).append(rectangle)
+        for color,rects in rectangles.items():
+            img = cv2.polylines(img, rects, True, color=color, thickness=2)
+        return img
+
+    def _fullBox(self):
+        height,width = self.imageSize()
+        return 0,0,width,height
+
+    def image(self,level=0):
+        if self.isTiled():
+            return self.imageRegion(self._fullBox(),level)
+        # the returned array is a cache and is updated in place on the next call
+        if self._composite is None:
+            self._composite = self._imgArray.copy()
+            self._invalidate()
+        for box in self._dirty:
+            self._composeRegion(*box)
+            for _,dirty in self._compositeLevels.values():
+                dirty.append(box)
+        self._dirty = []
+
+        level = self._level(level)
+        if level == 0:
+            return self._composite
+        if level not in self._compositeLevels:
+            self._compositeLevels[level] = (_downscale(self._composite,level),[])
+        composite,dirty = self._compositeLevels[level]
+        # only the blocks covering an edited region are averaged again
+        scale = 2**level
+        for x1,y1,x2,y2 in dirty:
+            x1,y1 = x1//scale,y1//scale
+            x2,y2 = min(composite.shape[1],-(-x2//scale)),min(composite.shape[0],-(-y2//scale))
+            if x1 < x2 and y1 < y2:
+                composite[y1:y2,x1:x2] = _downscale(self._composite[y1*scale:y2*scale,x1*scale:x2*scale],level)
+        dirty.clear()
+        return composite
     
+    def rawImage(self,level=0):
+        if self.isTiled():
+            return self.rawRegion(self._fullBox(),level)
+        level = self._level(level)
+        if level == 0:
+            return self._imgArray
+        if level not in self._levels:
+            self._levels[level] = _downscale(self.rawImage(level-1),1)
+        return self._levels[level]
+
+    def overlay(self):
+        ''' what image() and boundingboxImage() burn into the pixels, as vectors in image coordinates '''
+        annotation = self.annotation()
+        polygons = [(annotation.getShapePoints(i),annotation.getColor(o))
+                    for o,idxs in annotation.getObjectShapes().items() for i in idxs]
+        boxes = [(bounds,annotation.getColor(o)) for o,bounds in annotation.getObjectBounds().items()]
+        return {"polygons": polygons,"boxes": boxes,"filling": self._fillingPoints}
+
     def mask(self):
         return self._maskArray
     
-    def maskImage(self):
-        img = np.zeros_like(self._imgArray)
-        objectShapes = self.annotation().getObjectShapes()
-        for o,shapeIdxs in objectShapes.items():
-            color = self.annotation().getColor(o)
-            for index in shapeIdxs:
-                shape = self.annotation().getShape(index)
-                points = shape["points"]
-                polygon = np.array(points)
-                polygon = polygon.reshape((-1,1,2)).astype(np.int32)
-                img = cv2.drawContours(img, [polygon], -1, color=color, thickness=cv2.FILLED)
-        return img
+    def maskImage(self,level=0):
+        if self.isTiled():
+            return self.maskRegion(self._fullBox(),level)
+        labels = self._labelMap
+        level = self._level(level)
+        if level > 0:
+            # object ids can't be averaged, the block centers are sampled instead
+            scale = 2**level
+            height,width = labels.shape[0]//scale, labels.shape[1]//scale
+            labels = labels[scale//2::scale,scale//2::scale][:height,:width]
+        # np.take gathers whole palette rows, well ahead of fancy indexing on large maps
+        return np.take(self.annotation().palette(),labels,axis=0)
     
-    def boundingboxImage(self):
-        img = self._imgArray.copy()
-        objectShapes = self.annotation().getObjectShapes()
-        for o,shapeIdx in objectShapes.items():
-            color = self.annotation().getColor(o)
-            if len(shapeIdx) == 0:
-                continue
-            s1 = self.annotation().getShape(shapeIdx[0])
-            points = s1["points"]
-            polygon = np.array(points)
-            x1,y1,x2,y2 = polygon[:,0].min(),polygon[:,1].min(),polygon[:,0].max(),polygon[:,1].max()
-            for s2idx in shapeIdx[1:]:
-                s2 = self.annotation().getShape(s2idx)
-                points = s2["points"]
-                polygon = np.array(points)
-                x1,y1 = min(x1,polygon[:,0].min()),min(y1,polygon[:,1].min())
-                x2,y2 = max(x2,polygon[:,0].max()),max(y2,polygon[:,1].max())
-            
-            img = cv2.rectangle(img, (int(x1),int(y1)), (int(x2),int(y2)), color=color, thickness=2)         
+    def boundingboxImage(self,level=0):
+        if self.isTiled():
+            return self.boundingboxRegion(self._fullBox(),level)
+        level = self._level(level)
+        scale = 2**level
+        img = self.rawImage(level).copy()
+        annotation = self.annotation()
+        rectangles = {}
+        for o,bounds in annotation.getObjectBounds().items():
+            x1,y1,x2,y2 = [int(b)//scale for b in bounds]
+            rectangle = np.array([[x1,y1],[x2,y1],[x2,y2],[x1,y2]],dtype=np.int32).reshape((-1,1,2))
+            rectangles.setdefault(tuple(annotation.getColor(o)),[]).append(rectangle)
+
+        for color,rects in rectangles.items():
+            img = cv2.polylines(img, rects, True, color=color, thickness=2)
         return img
 
     def annotation(self):
         return self._annotation
 
-    def open(self):
-        self._img = Image.open(self._imgPath)
-        self._imgArray = np.asarray(self._img)
-        w,h, c = self._imgArray.shape
-        self._maskColor = np.zeros_like(self._imgArray)
-        self._contourFilling = np.zeros_like(self._imgArray)
+    def open(self,journal=False):
+        self._stale = False
+        if isTiledImage(self._imgPath):
+            # only the tiles of the regions shown are decoded, shapes are drawn per region
+            self._source = TiledImage(self._imgPath)
+        else:
+            # np.asarray copies the decoded pixels, the PIL image is not kept alongside them
+            with Image.open(self._imgPath) as img:
+                self._imgArray = np.asarray(img)
+            h,w = self._imgArray.shape[:2]
+            self._labelMap = np.zeros((h,w),dtype=np.uint16)
+            self._boundary = np.zeros((h,w),dtype=bool)
+            self._contourFilling = np.zeros((h,w),dtype=bool)
+        self._composite = None
+        self._levels = {}
+        self._compositeLevels = {}
+        self._dirty = []
+        self._fillingBox = None
+        self._fillingPoints = None
         self._labelsCount = {}
 
-        self._annotation = Annotation.fromJson(self._annotationPath)
-        for s in self.annotation().shapes():
-            objectId = s["group_id"]
-            points = s["points"]
-            color = self.annotation().getColor(objectId)
-            self.drawContourOnMask(points,color)
+        self._annotation = Annotation.fromJson(self._annotationPath,journal)
+        self.updateMask()
         
         for o in self.annotation().getObjectNames():
-            label = "_".join(objectId.split("_")[:-1])
-            count = int(objectId.split("_")[-1])
+            label = "_".join(o.split("_")[:-1])
+            count = int(o.split("_")[-1])
             if label in self._labelsCount:
                 nameCount, instanceCount = self._labelsCount[label]
                 self._labelsCount[label] = (max(nameCount,count),instanceCount+1)
@@ -340,17 +1324,45 @@ class DatasetItem:
                 self._labelsCount[label] = (count,1)
     
     def close(self):
-        self._img.close()
-        self._img = None
+        if self._annotation.journalRecords() > 0:
+            self.save(self._boundingBox)
+        self._annotation.closeJournal()
+        if self._source is not None:
+            self._source.close()
+        self._source = None
         self._annotation = None
         self._mask = None
         self._imgArray = None
+        self._labelMap = None
+        self._boundary = None
+        self._contourFilling = None
+        self._composite = None
+        self._levels = {}
+        self._compositeLevels = {}
+        self._dirty = []
+        self._fillingBox = None
+        self._fillingPoints = None
+        self._thumbnail = None
         self._changed = False
     
-    def save(self,boundingBox=False):
-        height,width,_ = self._imgArray.shape
+    def save(self,boundingBox=False,compact=True):
+        ''' with compact False, an annotation journaling its edits is only written once the journal grows large '''
+        self._boundingBox = boundingBox
+        if not compact and self._annotation.isJournaling() and self._annotation.journalSize() < JOURNAL_COMPACT_SIZE:
+            # every edit is already in the journal
+            self._changed = False
+            return
+        # cleared before the snapshot is taken, an edit made while writing sets it again
+        self._changed = False
+        height,width = self.imageSize()
         imgRelativePath = f"../imgs/{self._imgPath.split('/')[-1]}"
-        self._annotation.save(imgRelativePath,width,height,boundingBox)
+        try:
+            self._annotation.save(imgRelativePath,width,height,boundingBox)
+        except Exception:
+            self._changed = True
+            raise
+        if self._onSaved is not None:
+            self._onSaved()
 
         #self._mask.save()
         
@@ -379,27 +1391,54 @@ class DatasetItem:
 
     def fillInContour(self,objectId,contourIndex):
         index = self.annotation().getObjectShapes(objectId,"polygon")[contourIndex]
-        points = self.annotation().getShape(index)["points"]
+        points = self.annotation().getShapePoints(index)
         
         # single filling only
-        self._contourFilling = np.zeros_like(self._contourFilling)
-        polygon = np.array(points)
-        polygon = polygon.reshape((-1,1,2)).astype(np.int32)
-        self._contourFilling = cv2.drawContours(self._contourFilling, [polygon], -1, color=(0,0,255), thickness=cv2.FILLED)
+        if self._fillingBox is not None and not self.isTiled():
+            x1,y1,x2,y2 = self._fillingBox
+            self._contourFilling[y1:y2,x1:x2] = False
+            self._invalidate(self._fillingBox)
+        self._fillingBox = self._shapeBox(points)
+        self._fillingPoints = np.array(points)
+        x1,y1,x2,y2 = self._fillingBox
+        if x1 < x2 and y1 < y2 and not self.isTiled():
+            self._contourFilling[y1:y2,x1:x2] = self._rasterize(points,self._fillingBox,cv2.FILLED)
+        self._invalidate(self._fillingBox)
     
     def getContourBoundingBox(self,objectId,contourIndex):
         index = self.annotation().getObjectShapes(objectId,"polygon")[contourIndex]
-        points = self.annotation().getShape(index)["points"]
-        polygon = np.array(points)
-        x1,y1,x2,y2 = polygon[:,0].min(),polygon[:,1].min(),polygon[:,0].max(),polygon[:,1].max()
+        x1,y1,x2,y2 = self.annotation().getShapeBounds(index)
         return int(x1),int(y1),int(x2),int(y2)
 
+    def updateMaskRegion(self,box):
+        # clears box and redraws, clipped to it, only the shapes that can reach into it
+        x1,y1,x2,y2 = box
+        if x1 >= x2 or y1 >= y2 or self.isTiled():
+            return
+        self._labelMap[y1:y2,x1:x2] = 0
+        self._boundary[y1:y2,x1:x2] = False
+        # borders reach 3 pixels outside the shape bounds
+        for index in self.annotation().shapesInBox((x1-3,y1-3,x2+3,y2+3)):
+            objectIndex = self.annotation().getObjectIndex(self.annotation().getShapeObject(index))
+            self.drawContourOnMask(self.annotation().getShapePoints(index),objectIndex,box)
+        self._invalidate(box)
+
     def deleteContour(self,objectId,contourIndex):
+        index = self.annotation().getObjectShapes(objectId)[contourIndex]
+        box = self._shapeBox(self.annotation().getShapePoints(index),3)
         self.annotation().deleteShape(objectId,contourIndex)
-        self.updateMask()
-        self._contourFilling = np.zeros_like(self._contourFilling)
+        self.updateMaskRegion(box)
+        self.clearFilling()
         self._changed = True
 
+    def clearFilling(self):
+        if self._fillingBox is not None and not self.isTiled():
+            x1,y1,x2,y2 = self._fillingBox
+            self._contourFilling[y1:y2,x1:x2] = False
+            self._invalidate(self._fillingBox)
+        self._fillingBox = None
+        self._fillingPoints = None
+
     def createObject(self,label):
         if label in self._labelsCount:
             nameCount, instanceCount = self._labelsCount[label]
@@ -411,10 +1450,74 @@ class DatasetItem:
 
     def didChange(self):
         return self._changed
+
+    def discardChanges(self):
+        self._annotation.discardJournal()
+        self._changed = False
+        # the shapes in memory still hold the discarded edits, the item has to be reopened
+        self._stale = True
+
+    def isStale(self):
+        return self._stale
+
+    def setOnSaved(self,callback):
+        # may be called from the autosave thread
+        self._onSaved = callback
+
+    def setBoundingBox(self,enabled):
+        self._boundingBox = enabled
+
+    def markStale(self):
+        # the image was rewritten on disk, the item is closed instead of being kept open
+        self._stale = True
+
+    def isOpen(self):
+        return self._imgArray is not None or self._source is not None
+
+    def preview(self,levelFor):
+        ''' a fast reduced decode of a JPEG and its scale, or None. levelFor(height,width) is the
+            pyramid level an image of that size is shown at '''
+        with Image.open(self._imgPath) as img:
+            if img.format != "JPEG":
+                return None
+            width,height = img.size
+            level = min(JPEG_DRAFT_LEVELS,levelFor(height,width))
+            if level == 0:
+                return None
+            scale = 2**level
+            # the decoder picks the smallest reduction still covering the requested size
+            img.draft("RGB",(-(-width//scale),-(-height//scale)))
+            scale = round(width / img.size[0])
+            return np.asarray(img.convert("RGB")),scale
+
+    def thumbnail(self):
+        if self._thumbnail is None and self.isOpen():
+            height,width = self.imageSize()
+            scale = THUMBNAIL_SIZE / max(height,width)
+            size = (max(1,int(width*scale)),max(1,int(height*scale)))
+            # downscaled from the closest pyramid level, a tiled image is never decoded at full resolution
+            image = self.rawImage(pyramidLevel(1/scale))
+            self._thumbnail = cv2.resize(image,size,interpolation=cv2.INTER_AREA)
+        return self._thumbnail
+
+    def nbytes(self):
+        if not self.isOpen():
+            return 0
+        if self.isTiled():
+            return self._source.nbytes() + self._annotation.nbytes()
+        arrays = [self._imgArray,self._labelMap,self._boundary,self._contourFilling,self._composite]
+        arrays += list(self._levels.values()) + [composite for composite,_ in self._compositeLevels.values()]
+        return sum(a.nbytes for a in arrays if a is not None) + self._annotation.nbytes()
+
+    def skippedShapes(self):
+        return self._annotation.skippedShapes()
     
     def id(self):
         return self._id
 
+    def name(self):
+        return self._name
+
     @classmethod
     def create(cls,datasetPath,name,fileName,itemid):
         imgPath = f"{datasetPath}/imgs/{fileName}"
@@ -444,40 +1547,314 @@ class Key:
     def create(self,datasetPath,name,keyFileName):
         return Key(name,f'{datasetPath}/keys/{keyFileName}')
 
+class ItemCache:
+    ''' opened items kept by recency within a byte budget '''
+    def __init__(self,budget=ITEM_CACHE_BUDGET):
+        self._budget = budget
+        self._items = OrderedDict() # least recently used first
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def take(self,name):
+        item = self._items.pop(name,None)
+        if item is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return item
+
+    def contains(self,name):
+        return name in self._items
+
+    def discard(self,name):
+        item = self._items.pop(name,None)
+        if item is not None:
+            item.close()
+
+    def put(self,item):
+        self._items[item.name()] = item
+        self._items.move_to_end(item.name())
+        self._evict()
+
+    def nbytes(self):
+        return sum(item.nbytes() for item in self._items.values())
+
+    def _evict(self):
+        total = self.nbytes()
+        for name in list(self._items.keys()):
+            if total <= self._budget:
+                break
+            item = self._items[name]
+            # unsaved edits stay pinned, they are never dropped behind the user's back
+            if item.didChange():
+                continue
+            total -= item.nbytes()
+            del self._items[name]
+            item.close()
+            self._evictions += 1
+
+    def setBudget(self,budget):
+        self._budget = budget
+        self._evict()
+
+    def stats(self):
+        return {"hits": self._hits,"misses": self._misses,"evictions": self._evictions,
+                "items": len(self._items),"bytes": self.nbytes(),"budget": self._budget}
+
+    def close(self):
+        for item in self._items.values():
+            item.close()
+        self._items.clear()
+
+class ItemPrefetcher:
+    ''' opens dataset items in a thread pool ahead of them being selected '''
+    def __init__(self,budget=PREFETCH_BUDGET,workers=2):
+        self._budget = budget
+        # whether the composited overlay is rendered ahead, only the matplotlib canvas shows it
+        self._composite = True
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._entries = {} # name -> {"item","future","state"}
+        self._estimate = 0 # bytes of the last opened item, used before an item is open
+
+    def _open(self,entry,journal,composite):
+        with self._lock:
+            if entry["state"] == "cancelled":
+                return None
+            entry["state"] = "opening"
+        item = entry["item"]
+        item.open(journal)
+        # opening builds the label map; tiled items only render the regions shown
+        if not item.isTiled():
+            if composite:
+                item.image()
+            else:
+                # the native canvas draws the shapes over the raw image at the level shown
+                item.rawImage(PYRAMID_LEVELS)
+        with self._lock:
+            self._estimate = item.nbytes()
+            if entry["state"] != "cancelled":
+                entry["state"] = "opened"
+                return item
+        item.close()
+        return None
+
+    def _evict(self,name):
+        # called with the lock held, returns an item the caller has to close
+        entry = self._entries.pop(name)
+        if entry["state"] == "opened":
+            return entry["item"]
+        if entry["state"] == "pending" and entry["future"].cancel():
+            return None
+        # still opening, _open closes it and take() waits for that
+        entry["state"] = "cancelled"
+        self._entries[f"evicting:{name}"] = entry
+        return None
+
+    def take(self,name):
+        ''' the opened item or None, waits when it is still being opened '''
+        with self._lock:
+            evicting = self._entries.pop(f"evicting:{name}",None)
+            entry = self._entries.pop(name,None)
+        if evicting is not None:
+            evicting["future"].result()
+        if entry is None:
+            return None
+        return entry["future"].result()
+
+    def prefetch(self,items,journal=False):
+        ''' keeps items, nearest first, opened as far as the budget allows; closes the others '''
+        wanted = {item.name() for item in items}
+        toClose = []
+        with self._lock:
+            for name in [n for n in self._entries if not n.startswith("evicting:") and n not in wanted]:
+                item = self._evict(name)
+                if item is not None:
+                    toClose.append(item)
+            for name in [n for n,e in self._entries.items() if n.startswith("evicting:") and e["future"].done()]:
+                del self._entries[name]
+
+            used = sum(e["item"].nbytes() if e["state"] == "opened" else self._estimate
+                        for n,e in self._entries.items() if not n.startswith("evicting:"))
+            for position,item in enumerate(items):
+                if item.name() in self._entries or f"evicting:{item.name()}" in self._entries or item.isOpen():
+                    continue
+                # the first item is the one asked for, it is opened whatever the budget
+                if position > 0 and used + self._estimate > self._budget:
+                    break
+                entry = {"item": item,"state": "pending"}
+                entry["future"] = self._pool.submit(self._open,entry,journal,self._composite)
+                self._entries[item.name()] = entry
+                used += self._estimate
+        for item in toClose:
+            item.close()
+
+    def setComposite(self,enabled):
+        # takes effect from the next prefetched item
+        self._composite = enabled
+
+    def discard(self,name):
+        item = self.take(name)
+        if item is not None:
+            item.close()
+
+    def future(self,name):
+        with self._lock:
+            entry = self._entries.get(name)
+            return None if entry is None else entry["future"]
+
+    def close(self):
+        self.prefetch([])
+        with self._lock:
+            futures = [e["future"] for e in self._entries.values()]
+        for future in futures:
+            future.result()
+        self._pool.shutdown()
+
 class Dataset:
-    def __init__(self,path,imgFiles,keyFiles,videoFiles=None):
+    def __init__(self,path,imgFiles,keyFiles,videoFiles=None,manifest=None):
         self._path = path
         self._itemNames = [im.split(".")[0] for im in imgFiles]
         self._keysName = [key.split(".")[0] for key in keyFiles]
-        self._items = {name:DatasetItem.create(path,name,img,imgid) for name,img,imgid in zip(self._itemNames,imgFiles,range(len(imgFiles)))}
+        self._entries = {name:(img,imgid) for imgid,(name,img) in enumerate(zip(self._itemNames,imgFiles))}
+        # DatasetItems are only created when first used, see _item
+        self._items = {}
+        self._manifest = manifest
         self._keys = {name:Key.create(path,name,key) for name,key in zip(self._keysName,keyFiles)}
         self._currentItem = None
+        self._simplifyTolerance = SIMPLIFY_TOLERANCE
+        self._autoSaver = AutoSaver()
+        self._journal = False
+        self._boundingBox = False
+        self._prefetcher = ItemPrefetcher()
+        self._cache = ItemCache()
+        self._thumbnails = OrderedDict()
         if videoFiles is not None:
             self._videoNames = [vi.split(".")[0] for vi in videoFiles]
             self._videos = {name: Video.create(f"{path}/videos/{vfile}") for name,vfile in zip(self._videoNames,videoFiles)}
         else:
             self._videoNames = []
             self._videos = {}
+        self._frameStore = None
         
     def names(self):
         return self._names
     
+    def _item(self,name):
+        item = self._items.get(name)
+        if item is None:
+            fileName,itemid = self._entries[name]
+            item = DatasetItem.create(self._path,name,fileName,itemid)
+            item.setBoundingBox(self._boundingBox)
+            if self._manifest is not None:
+                # keeps the annotated flag current without relisting annotations/ on the next load
+                item.setOnSaved(lambda: self._manifest.recordSaved(fileName))
+            self._items[name] = item
+        return item
+
+    def _neighbours(self,name,depth=PREFETCH_ITEMS):
+        # next and previous items, nearest first
+        position = self._entries[name][1]
+        names = []
+        for i in range(1,depth+1):
+            for p in (position+i,position-i):
+                if 0 <= p < len(self._itemNames):
+                    names.append(self._itemNames[p])
+        return [self._item(n) for n in names]
+
     def changeItem(self,newName,save=True):
+        if self._currentItem:
+            self._autoSaver.flush(self._currentItem.name())
         if save and self._currentItem:
-            self._currentItem.save()
+            self._currentItem.save(self._boundingBox)
         if self._currentItem:
-            self._currentItem.close()
-        self._currentItem = self._items[newName]
-        self._currentItem.open()
+            if self._currentItem.isStale():
+                self._currentItem.close()
+            else:
+                # the contour selection doesn't outlive the visit
+                self._currentItem.clearFilling()
+                self._cache.put(self._currentItem)
+        self._currentItem = self._cache.take(newName)
+        if self._currentItem is None:
+            self._currentItem = self._prefetcher.take(newName)
+        if self._currentItem is None:
+            self._currentItem = self._item(newName)
+            self._currentItem.open(self._journal)
+        self._prefetcher.prefetch(self._neighbours(newName),self._journal)
+        if self._manifest is not None:
+            self._manifest.recordSize(self._entries[newName][0],*self._currentItem.imageSize())
+
+        self._thumbnails[newName] = self._currentItem.thumbnail()
+        self._thumbnails.move_to_end(newName)
+        while len(self._thumbnails) > THUMBNAIL_CACHE:
+            self._thumbnails.popitem(last=False)
+
+    def _forget(self,name):
+        # the image of name was rewritten, open copies of the old one must not be reused
+        if self._currentItem is not None and self._currentItem.name() == name:
+            self._currentItem.markStale()
+        self._cache.discard(name)
+        self._prefetcher.discard(name)
+        self._thumbnails.pop(name,None)
+
+    def requestItem(self,name):
+        ''' a future done once changeItem(name) can swap the item in without opening it, or None
+            when it can only be opened synchronously. Pending requests for other items are cancelled. '''
+        item = self._item(name)
+        # DatasetItem state is only read for items no prefetch thread can be opening or closing
+        if item is self._currentItem or self._cache.contains(name):
+            future = Future()
+            future.set_result(item)
+            return future
+        self._prefetcher.prefetch([item] + self._neighbours(name),self._journal)
+        return self._prefetcher.future(name)
+
+    def thumbnail(self,name):
+        ''' a small copy of the item's image if it was shown before, else None '''
+        return self._thumbnails.get(name)
+
+    def preview(self,name,levelFor):
+        ''' see DatasetItem.preview, None as well for an item swapped in without opening it '''
+        if name == self.currentItemName() or self._cache.contains(name):
+            return None
+        # only reads the image file, whatever a prefetch thread does with the item
+        return self._item(name).preview(levelFor)
+
+    def currentItemName(self):
+        if self._currentItem is None:
+            return None
+        return self._currentItem.name()
     
-    def currentImage(self):
-        return self._currentItem.image()
+    def currentImage(self,level=0):
+        return self._currentItem.image(level)
     
-    def currentMaskImage(self):
-        return self._currentItem.maskImage()
+    def currentMaskImage(self,level=0):
+        return self._currentItem.maskImage(level)
+
+    def currentRawImage(self,level=0):
+        return self._currentItem.rawImage(level)
+
+    def currentOverlay(self):
+        return self._currentItem.overlay()
 
-    def currentBoundingboxImage(self):
-        return self._currentItem.boundingboxImage()
+    def currentBoundingboxImage(self,level=0):
+        return self._currentItem.boundingboxImage(level)
+
+    def currentImageSize(self):
+        return self._currentItem.imageSize()
+
+    def currentIsTiled(self):
+        return self._currentItem.isTiled()
+
+    def currentRegionBox(self,box,level=0):
+        return self._currentItem.regionBox(box,level)
+
+    def currentRawRegion(self,box,level=0):
+        return self._currentItem.rawRegion(box,level)
+
+    def currentMaskRegion(self,box,level=0):
+        return self._currentItem.maskRegion(box,level)
 
     def currentMask(self):
         return self._currentItem.mask()
@@ -486,7 +1863,10 @@ class Dataset:
         return self._currentItem.annotation()
     
     def addShape(self,label,shapeStr,points,objectId):
-        self._currentItem.addShape(label,shapeStr,points,objectId)
+        self._currentItem.addShape(label,shapeStr,points,objectId,self._simplifyTolerance)
+
+    def setSimplifyTolerance(self,tolerance):
+        self._simplifyTolerance = tolerance
 
     def keys(self):
         return list(self._keys.keys())
@@ -504,7 +1884,13 @@ class Dataset:
         self._keys[name].decr()
 
     def itemNames(self):
-        return list(self._items.keys())
+        return list(self._itemNames)
+
+    def itemInfo(self,name):
+        ''' {"annotated","width","height"} from the manifest, None without one '''
+        if self._manifest is None:
+            return None
+        return self._manifest.info(self._entries[name][0])
 
     def objectNames(self):
         return self._currentItem.objectNames()
@@ -515,8 +1901,65 @@ class Dataset:
     def shapesForObject(self,objectId,shapeType=None):
         return self._currentItem.shapesForObject(objectId,shapeType)
     
-    def save(self,boundingBox=False):
-        self._currentItem.save(boundingBox)
+    def save(self,boundingBox=False,background=False):
+        item = self._currentItem
+        if background:
+            # whether the journal stands in for the write depends on how the item was opened, not on the current setting
+            self._autoSaver.schedule(item.name(),lambda: item.save(boundingBox,compact=False))
+        else:
+            self._autoSaver.flush(item.name())
+            item.save(boundingBox)
+
+    def setJournal(self,enabled):
+        # takes effect from the next opened item
+        self._journal = enabled
+
+    def setPrefetchComposite(self,enabled):
+        # whether prefetched items render the composited overlay, which only the matplotlib canvas shows
+        self._prefetcher.setComposite(enabled)
+
+    def setBoundingBox(self,enabled):
+        # used by items that compact their journal on close, whether or not they were saved
+        self._boundingBox = enabled
+        for item in self._items.values():
+            item.setBoundingBox(enabled)
+
+    def discardChanges(self):
+        self._currentItem.discardChanges()
+
+    def skippedShapes(self):
+        return self._currentItem.skippedShapes()
+
+    def saveStatus(self):
+        # "dirty", "saving", "saved" or None when the current item was never autosaved
+        if self._currentItem is None:
+            return None
+        return self._autoSaver.status(self._currentItem.name())
+
+    def saveError(self):
+        # the error of the last failed autosave of the current item, it is retried until it succeeds
+        if self._currentItem is None:
+            return None
+        return self._autoSaver.error(self._currentItem.name())
+
+    def cacheStats(self):
+        return self._cache.stats()
+
+    def setCacheBudget(self,budget):
+        self._cache.setBudget(budget)
+
+    def close(self):
+        self._prefetcher.close()
+        # pending saves go first, closing the open items then compacts their journals
+        self._autoSaver.flush()
+        if self._currentItem is not None:
+            self._currentItem.close()
+            self._currentItem = None
+        self._cache.close()
+        # a save that failed again is given up with its item closed
+        self._autoSaver.close(flush=False)
+        if self._manifest is not None:
+            self._manifest.close()
     
     def fillInContour(self,currentObject,contourId):
         self._currentItem.fillInContour(currentObject,contourId)
@@ -535,7 +1978,13 @@ class Dataset:
 
     def openVideo(self,videoId):
         return self._videos[videoId].open()
-    
+
+    def storeVideoFrames(self,videoId,start=0,end=None,scale=1.0,progress=None,cancel=None):
+        ''' see Video.storeFrames, runs for as long as the frames take to decode '''
+        if self._frameStore is None:
+            self._frameStore = FrameStore()
+        return self._videos[videoId].storeFrames(self._frameStore,start,end,scale,progress,cancel)
+
     def closeVideo(self,videoId):
         return self._videos[videoId].close()
     
@@ -547,6 +1996,9 @@ class Dataset:
     
     def videoLength(self,videoId):
         return self._videos[videoId].numOfFrames()
+
+    def videoSize(self,videoId):
+        return self._videos[videoId].size()
     
     def videoNext(self,videoId,jump=1):
         return self._videos[videoId].readNext(jump)
@@ -564,8 +2016,8 @@ class Dataset:
         video = self._videos[videoId]
         frame = video.currentFrame()
         name = f"{videoId}_{frame}"
-        if name in self._itemNames:
-            itemid = self._items[name].id()
+        if name in self._entries:
+            itemid = self._entries[name][1]
             overwrite = notify(f"{name} already exists. Do you want to overwrite it?","yesno")
             if not overwrite:
                 return False,name,itemid    
@@ -573,13 +2025,118 @@ class Dataset:
             self._itemNames.append(name)
             itemid = len(self._itemNames)-1
         
-        ret,frame = video.read()
+        ret,frame = video.read(fullResolution=True)
         if ret:
             imageio.imwrite(f"{self._path}/imgs/{name}.jpg", frame)
-            self._items[name] = DatasetItem.create(self._path,name,f"{name}.jpg",itemid) 
+            self._forget(name)
+            self._entries[name] = (f"{name}.jpg",itemid)
+            # created again by _item from the new entry
+            self._items.pop(name,None)
 
         return True,name,itemid
 
+    def _sampleDistinct(self,videoPath,frameNums,names,outputs,overwrite,threshold,workers,progress):
+        # hashes depend on the last kept frame so decoding is sequential, only encoding is pooled
+        cap = cv2.VideoCapture(videoPath)
+        written = []
+        pending = []
+        lastHash = None
+        with ThreadPoolExecutor(max_workers=max(1,workers)) as pool:
+            for frameNum,frame in _decodeFrames(cap,frameNums):
+                h = frameHash(frame)
+                if lastHash is not None and hashDistance(h,lastHash) <= threshold:
+                    continue
+                lastHash = h
+
+                if names[frameNum] in self._entries and not overwrite:
+                    continue
+                pending.append((frameNum,pool.submit(imageio.imwrite,outputs[frameNum],frame)))
+                # bound the number of decoded frames waiting for the encoder
+                while len(pending) > 2*max(1,workers):
+                    f,future = pending.pop(0)
+                    future.result()
+                    written.append(f)
+                if progress is not None:
+                    progress(bisect_right(frameNums,frameNum),len(frameNums))
+            for f,future in pending:
+                future.result()
+                written.append(f)
+        cap.release()
+        return written
+
+    def sampleFrames(self,videoId,start=0,end=None,stride=None,count=None,overwrite=False,
+                        imgFormat="jpg",workers=SAMPLE_WORKERS,progress=None,duplicateThreshold=None):
+        ''' samples every stride-th frame, or count evenly spaced frames, of [start,end) and
+            registers them as dataset items. progress(done,total) reports how far sampling got.
+            With duplicateThreshold, frames whose hash is within that many bits of the last
+            kept frame are skipped. '''
+        videoPath = self._videos[videoId].path()
+        cap = cv2.VideoCapture(videoPath)
+        if not cap.isOpened():
+            return False,[],"Error opening video stream or file"
+        numOfFrames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        if end is None or end > numOfFrames:
+            end = numOfFrames
+        start = max(0,start)
+        if start >= end:
+            return False,[],f"Empty frame range {start}-{end}"
+
+        if count is not None:
+            frameNums = sorted(set(np.linspace(start,end-1,max(1,count)).astype(int).tolist()))
+        else:
+            frameNums = list(range(start,end,max(1,stride or 1)))
+
+        names = {f: f"{videoId}_{f}" for f in frameNums}
+        if duplicateThreshold is not None:
+            outputs = {f: f"{self._path}/imgs/{names[f]}.{imgFormat}" for f in frameNums}
+            written = self._sampleDistinct(videoPath,frameNums,names,outputs,overwrite,duplicateThreshold,workers,progress)
+            return True,self._registerSamples(written,names,imgFormat),""
+
+        if not overwrite:
+            frameNums = [f for f in frameNums if names[f] not in self._entries]
+        if len(frameNums) == 0:
+            return True,[],""
+
+        outputs = {f: f"{self._path}/imgs/{names[f]}.{imgFormat}" for f in frameNums}
+        # one contiguous run of the sorted frames per worker, each seeks once and decodes forward
+        size = -(-len(frameNums)//max(1,workers))
+        chunks = [frameNums[i:i+size] for i in range(0,len(frameNums),size)]
+
+        written = []
+        done = [0]
+        lock = threading.Lock()
+        def onFrame():
+            with lock:
+                done[0] += 1
+        with ThreadPoolExecutor(max_workers=max(1,workers)) as pool:
+            pending = {pool.submit(_sampleChunk,videoPath,chunk,outputs,onFrame) for chunk in chunks}
+            while pending:
+                finished,pending = wait(pending,timeout=0.1)
+                for future in finished:
+                    written.extend(future.result())
+                # reported from the calling thread, progress may touch the GUI
+                if progress is not None:
+                    progress(done[0],len(frameNums))
+
+        return True,self._registerSamples(written,names,imgFormat),""
+
+    def _registerSamples(self,written,names,imgFormat):
+        added = []
+        for f in sorted(written):
+            name = names[f]
+            if name in self._entries:
+                itemid = self._entries[name][1]
+                self._forget(name)
+            else:
+                self._itemNames.append(name)
+                itemid = len(self._itemNames)-1
+            self._entries[name] = (f"{name}.{imgFormat}",itemid)
+            self._items.pop(name,None)
+            added.append((name,itemid))
+        return added
+
 
     @classmethod
     def load(cls,path):
@@ -593,10 +2150,13 @@ class Dataset:
         if not exists(imgPath) or not exists(annotationPath) or not exists(keysPath) or not exists(maskPath):
             return False,None,"Dataset folder must contain four folders: imgs, annotations, masks, and keys"
         
-        imgs = sorted([f for f in os.listdir(imgPath) if f.upper().endswith(VALID_FORMAT)])
+        # imgs/ and annotations/ are only listed again when their entries changed since the last load
+        manifest = Manifest(path)
+        imgs = manifest.images(VALID_FORMAT)
 
         keys = sorted([f for f in os.listdir(keysPath) if f.upper().endswith(VALID_FORMAT)])
         if len(keys) == 0:
+            manifest.close()
             return False,None,"The dataset doesn't contain any key"
         
         if os.path.exists(videosPath):
@@ -604,4 +2164,4 @@ class Dataset:
         else:
             videos = []
 
-        return True, Dataset(path,imgs,keys,videos),""
+        return True, Dataset(path,imgs,keys,videos,manifest),""
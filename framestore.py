@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import weakref
+import numpy as np
+
+FRAME_STORE_PATH = os.path.join(tempfile.gettempdir(),"LassoLabeler","frames")
+FRAME_STORE_BUDGET = 20 * 1024**3 # bytes
+
+
+class StoredFrames:
+    def __init__(self,key,frames,start,end):
+        self._key = key
+        self._frames = frames
+        self._start = start
+        self._end = end
+
+    def key(self):
+        return self._key
+
+    def isOpen(self):
+        return self._frames is not None
+
+    def contains(self,frameNum):
+        return self._start <= frameNum < self._end
+
+    def get(self,frameNum):
+        # zero-copy view into the memory map
+        return self._frames[frameNum - self._start]
+
+    def close(self):
+        self._frames = None
+
+
+class FrameStore:
+    def __init__(self,path=FRAME_STORE_PATH,budget=FRAME_STORE_BUDGET):
+        self._path = path
+        self._budget = budget
+        # stores opened from here, their files stay mapped until closed and are never evicted
+        self._opened = weakref.WeakSet()
+        self._lock = threading.Lock()
+        os.makedirs(self._path,exist_ok=True)
+
+    def _key(self,videoPath,start,end,scale):
+        stat = os.stat(videoPath)
+        signature = f"{os.path.realpath(videoPath)}|{stat.st_size}|{stat.st_mtime}|{start}|{end}|{scale}"
+        return hashlib.sha1(signature.encode()).hexdigest()
+
+    def _files(self,key):
+        return f"{self._path}/{key}.frames", f"{self._path}/{key}.json"
+
+    def _entries(self):
+        entries = []
+        for f in os.listdir(self._path):
+            if not f.endswith(".json"):
+                continue
+            key = f[:-len(".json")]
+            framesFile, metaFile = self._files(key)
+            size = os.path.getsize(framesFile) if os.path.exists(framesFile) else 0
+            entries.append((os.path.getmtime(metaFile),key,size))
+        return entries
+
+    def usage(self):
+        return sum(size for _,_,size in self._entries())
+
+    def _remove(self,key):
+        # the frames go first: while they remain so does the meta file, and the next eviction tries again
+        for f in self._files(key):
+            if os.path.exists(f):
+                try:
+                    os.remove(f)
+                except OSError:
+                    # still mapped by another process, which Windows doesn't allow removing
+                    return False
+        return True
+
+    def _evict(self,required):
+        # nothing is dropped for a store that can never fit
+        if required > self._budget:
+            return False
+        with self._lock:
+            mapped = {frames.key() for frames in self._opened if frames.isOpen()}
+        # least recently used stores go first
+        entries = sorted(self._entries())
+        total = sum(size for _,_,size in entries)
+        for _,key,size in entries:
+            if total + required <= self._budget:
+                break
+            if key not in mapped and self._remove(key):
+                total -= size
+        return total + required <= self._budget
+
+    def open(self,videoPath,start,end,scale):
+        key = self._key(videoPath,start,end,scale)
+        framesFile, metaFile = self._files(key)
+        if not os.path.exists(metaFile):
+            return None
+        with open(metaFile) as f:
+            meta = json.load(f)
+        if not meta["complete"]:
+            return None
+        frames = np.memmap(framesFile,dtype=np.uint8,mode="r",shape=(meta["count"],meta["height"],meta["width"],3))
+        os.utime(metaFile)
+        stored = StoredFrames(key,frames,start,start + meta["count"])
+        with self._lock:
+            self._opened.add(stored)
+        return stored
+
+    def build(self,videoPath,start,end,scale,height,width,frames,cancel=None):
+        ''' frames yields RGB frames from start to end, already scaled to height x width. Nothing
+            is kept when the cancel event is set. '''
+        count = end - start
+        required = count * height * width * 3
+        if not self._evict(required):
+            return None
+
+        key = self._key(videoPath,start,end,scale)
+        framesFile, metaFile = self._files(key)
+        meta = {"video": videoPath,"start": start,"count": count,"height": height,"width": width,"complete": False}
+        with open(metaFile,"w") as f:
+            f.write(json.dumps(meta))
+
+        store = np.memmap(framesFile,dtype=np.uint8,mode="w+",shape=(count,height,width,3))
+        written = 0
+        for frame in frames:
+            if written == count:
+                break
+            store[written] = frame
+            written += 1
+        store.flush()
+        del store
+
+        if written == 0 or cancel is not None and cancel.is_set():
+            self._remove(key)
+            return None
+
+        # the container may report more frames than it can decode
+        if written < count:
+            with open(framesFile,"r+b") as f:
+                f.truncate(written * height * width * 3)
+        meta["count"] = written
+        meta["complete"] = True
+        with open(metaFile,"w") as f:
+            f.write(json.dumps(meta))
+        return self.open(videoPath,start,end,scale)
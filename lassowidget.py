@@ -13,6 +13,8 @@ import time
 
 class LassoWidget(FigureCanvas):
     selectionChanged = pyqtSignal(list)
+    # the screen pixels covering the image changed
+    viewChanged = pyqtSignal()
     def __init__(self,parent,image=None):        
         self.fig = Figure(tight_layout=True)
         FigureCanvas.__init__(self,self.fig)
@@ -32,6 +34,14 @@ class LassoWidget(FigureCanvas):
     def on_select(self,points):
         self.selectionChanged.emit(points)
 
+    def imagePixelsPerScreenPixel(self,width,height):
+        ratio = self.devicePixelRatioF()
+        return max(width/max(1,self.width()*ratio),height/max(1,self.height()*ratio))
+
+    def resizeEvent(self,event):
+        FigureCanvas.resizeEvent(self,event)
+        self.viewChanged.emit()
+
     def disconnect(self):
         self._lasso.disconnect_events()
     
@@ -43,8 +53,11 @@ class LassoWidget(FigureCanvas):
         self._lasso.line.set_visible(False)
         self.verts = None
 
-    def updateImage(self,image):
+    def updateImage(self,image,scale=1):
+        ''' image may be a pyramid level, scale times smaller than the full resolution image '''
         self._ax.clear()
-        self._ax.imshow(image)
+        height,width = image.shape[:2]
+        # data coordinates stay those of the full resolution image whatever level is shown
+        self._ax.imshow(image,extent=(-0.5,width*scale-0.5,height*scale-0.5,-0.5))
         self.fig.canvas.draw()
         #self.flush_events()
@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+
+MANIFEST_FILE = "manifest.sqlite"
+MANIFEST_VERSION = 1
+
+
+class Manifest:
+    ''' image files, sizes and annotation presence of a dataset, kept between runs in the dataset folder '''
+    def __init__(self,path):
+        self._path = path
+        # saves are recorded from the autosave thread
+        self._lock = threading.Lock()
+        try:
+            self._db = sqlite3.connect(f"{path}/{MANIFEST_FILE}",check_same_thread=False)
+            self._create()
+        except sqlite3.DatabaseError:
+            # read only or damaged, the folders are listed on every load instead
+            self._db = sqlite3.connect(":memory:",check_same_thread=False)
+            self._create()
+
+    def _create(self):
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != MANIFEST_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS items")
+            self._db.execute("DROP TABLE IF EXISTS folders")
+            self._db.execute(f"PRAGMA user_version = {MANIFEST_VERSION}")
+        self._db.execute("CREATE TABLE IF NOT EXISTS items (file TEXT PRIMARY KEY, name TEXT NOT NULL, "
+                         "annotated INTEGER NOT NULL DEFAULT 0, width INTEGER, height INTEGER, mtime INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS items_name ON items (name)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL)")
+        self._db.commit()
+
+    def _changed(self,folder):
+        # a folder's mtime only moves when entries are added, removed or renamed; it is
+        # read before listing so that entries added meanwhile are caught on the next load
+        mtime = os.stat(folder).st_mtime_ns
+        row = self._db.execute("SELECT mtime FROM folders WHERE path = ?",(folder,)).fetchone()
+        return row is None or row[0] != mtime, mtime
+
+    def _reconcileImages(self,folder,formats):
+        changed,mtime = self._changed(folder)
+        if not changed:
+            return
+        files = {e.name for e in os.scandir(folder) if e.name.upper().endswith(formats) and e.is_file()}
+        known = {f for f, in self._db.execute("SELECT file FROM items")}
+        self._db.executemany("DELETE FROM items WHERE file = ?",[(f,) for f in known - files])
+        added = [(f,f.split(".")[0]) for f in files - known]
+        self._db.executemany("INSERT INTO items (file,name,annotated) VALUES (?,?,?)",
+                             [(f,name,int(os.path.exists(f"{self._path}/annotations/{name}.json"))) for f,name in added])
+        self._db.execute("INSERT OR REPLACE INTO folders (path,mtime) VALUES (?,?)",(folder,mtime))
+
+    def _reconcileAnnotations(self,folder):
+        changed,mtime = self._changed(folder)
+        if not changed:
+            return
+        annotated = {e.name[:-len(".json")] for e in os.scandir(folder) if e.name.endswith(".json")}
+        known = {n for n, in self._db.execute("SELECT name FROM items WHERE annotated = 1")}
+        self._db.executemany("UPDATE items SET annotated = 1 WHERE name = ?",[(n,) for n in annotated - known])
+        self._db.executemany("UPDATE items SET annotated = 0 WHERE name = ?",[(n,) for n in known - annotated])
+        self._db.execute("INSERT OR REPLACE INTO folders (path,mtime) VALUES (?,?)",(folder,mtime))
+
+    def _write(self,statements):
+        # committed right away, the write lock on the file is never held between records
+        try:
+            for sql,args in statements:
+                self._db.execute(sql,args)
+            self._db.commit()
+        except sqlite3.OperationalError:
+            # locked by another process; the record is lost and the folders are listed again on the next load
+            self._db.rollback()
+
+    def images(self,formats):
+        ''' the sorted image files of imgs/, whose folders are only listed when they changed since the last load '''
+        with self._lock:
+            try:
+                self._reconcileImages(f"{self._path}/imgs",formats)
+                self._reconcileAnnotations(f"{self._path}/annotations")
+                self._db.commit()
+                return [f for f, in self._db.execute("SELECT file FROM items ORDER BY file")]
+            except sqlite3.OperationalError:
+                # locked by another process writing to it, listed without the manifest this time
+                self._db.rollback()
+                return sorted(e.name for e in os.scandir(f"{self._path}/imgs") if e.name.upper().endswith(formats) and e.is_file())
+
+    def info(self,file):
+        ''' {"annotated","width","height"} of an image, the size is None until the item was opened once '''
+        with self._lock:
+            try:
+                row = self._db.execute("SELECT annotated,width,height FROM items WHERE file = ?",(file,)).fetchone()
+            except sqlite3.OperationalError:
+                return None
+        if row is None:
+            return None
+        return {"annotated": bool(row[0]),"width": row[1],"height": row[2]}
+
+    def recordSize(self,file,height,width):
+        # the size is checked again when the image was rewritten in place
+        mtime = os.stat(f"{self._path}/imgs/{file}").st_mtime_ns
+        with self._lock:
+            self._write([("UPDATE items SET width = ?, height = ?, mtime = ? WHERE file = ? AND (mtime IS NULL OR mtime != ?)",
+                          (width,height,mtime,file,mtime))])
+
+    def recordSaved(self,file):
+        ''' called once the annotation of file is written. The write moved the mtime of annotations/,
+            which is taken as known so that saving doesn't force a listing of the folder on the next load '''
+        folder = f"{self._path}/annotations"
+        mtime = os.stat(folder).st_mtime_ns
+        with self._lock:
+            self._write([("UPDATE items SET annotated = 1 WHERE file = ?",(file,)),
+                         ("UPDATE folders SET mtime = ? WHERE path = ?",(mtime,folder))])
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+''' Headless batch sampling of video frames into a dataset. '''
+
+import argparse
+import sys
+from dataset import Dataset
+
+def main():
+    parser = argparse.ArgumentParser(description="Sample frames of a dataset video into imgs/")
+    parser.add_argument("dataset", help="dataset folder")
+    parser.add_argument("video", help="video name inside the dataset videos folder, without extension")
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--end", type=int, default=None)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--stride", type=int, default=None, help="keep every Nth frame")
+    group.add_argument("--count", type=int, default=None, help="number of evenly spaced frames to keep")
+    parser.add_argument("--format", default="jpg", choices=["jpg", "png"])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--overwrite", action="store_true", help="rewrite frames that already exist")
+    parser.add_argument("--dedupe", type=int, default=None, metavar="BITS",
+                        help="skip frames whose 64 bit hash differs from the last kept frame by at most BITS")
+    args = parser.parse_args()
+
+    success, dataset, errorMsg = Dataset.load(args.dataset)
+    if not success:
+        print(errorMsg, file=sys.stderr)
+        return 1
+    if args.video not in dataset.videos():
+        print(f"{args.video} is not a video of {args.dataset}", file=sys.stderr)
+        return 1
+
+    def progress(done, total):
+        print(f"\r{done}/{total}", end="", flush=True)
+
+    kwargs = {} if args.workers is None else {"workers": args.workers}
+    success, added, errorMsg = dataset.sampleFrames(args.video, args.start, args.end, args.stride, args.count,
+                                                    args.overwrite, args.format, progress=progress,
+                                                    duplicateThreshold=args.dedupe, **kwargs)
+    print()
+    if not success:
+        print(errorMsg, file=sys.stderr)
+        return 1
+    print(f"{len(added)} frames sampled")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
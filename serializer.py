@@ -0,0 +1,159 @@
+import json
+
+# orjson is several times faster than the json module when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class AnnotationSerializer:
+    ''' reads and writes labelme annotation files '''
+    def __init__(self,compact=False,precision=3,fast=True):
+        self._compact = compact
+        self._precision = precision # decimals kept for written coordinates, shapes are float32 in memory
+        self._fast = fast and orjson is not None
+
+    def precision(self):
+        return self._precision
+
+    def dumps(self,ann):
+        if self._fast and self._compact:
+            return orjson.dumps(ann)
+        if self._compact:
+            return json.dumps(ann,separators=(",",":")).encode()
+        # orjson only indents by 2, keep the 4 spaces the files have always used
+        return json.dumps(ann,indent=4).encode()
+
+    def loads(self,data):
+        if self._fast:
+            return orjson.loads(data)
+        return json.loads(data)
+
+    def load(self,path):
+        # any labelme file reads the same, whatever mode wrote it
+        with open(path,"rb") as f:
+            return self.loads(f.read())
+
+    def dump(self,ann,path):
+        with open(path,"wb") as f:
+            f.write(self.dumps(ann))
+
+
+_serializer = AnnotationSerializer()
+
+def get():
+    return _serializer
+
+def configure(compact=False,precision=3,fast=True):
+    global _serializer
+    _serializer = AnnotationSerializer(compact,precision,fast)
+    return _serializer
+
+
+# files above this size are read with StreamingReader, below it a whole-file parse is faster
+STREAMING_SIZE = 1024**2
+# fields of other tools' labelme files that are skipped without being decoded
+SKIPPED_FIELDS = ("imageData",)
+
+class StreamingReader:
+    ''' reads a labelme file chunk by chunk, handing each shape over as soon as it is parsed '''
+    def __init__(self,path,chunkSize=1024**2):
+        self._file = open(path,encoding="utf-8")
+        self._chunkSize = chunkSize
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self._eof:
+            return False
+        data = self._file.read(self._chunkSize)
+        if not data:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of annotation file")
+
+    def _expect(self,char):
+        if self._peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self._pos} of the annotation file")
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf,self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # a number cut by the chunk boundary still decodes, it is only complete once a delimiter follows
+            if self._buf[self._pos] not in "{[\"" and (end == len(self._buf) or self._buf[end] in "0123456789.eE+-") and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _skipValue(self):
+        if self._peek() != '"':
+            self._value()
+            return
+        # strings are scanned for their closing quote without being decoded
+        self._pos += 1
+        while True:
+            end = self._buf.find('"',self._pos)
+            while end != -1:
+                backslashes = 0
+                while end-1-backslashes >= 0 and self._buf[end-1-backslashes] == "\\":
+                    backslashes += 1
+                if backslashes % 2 == 0:
+                    self._pos = end + 1
+                    return
+                end = self._buf.find('"',end+1)
+            # keep a trailing run of backslashes, it may escape a quote in the next chunk
+            self._pos = len(self._buf.rstrip("\\"))
+            if not self._fill():
+                raise ValueError("Unterminated string in annotation file")
+
+    def read(self,onShape):
+        ''' calls onShape(shape) for every element of "shapes", returns the other top level fields '''
+        fields = {}
+        try:
+            self._expect("{")
+            if self._peek() == "}":
+                return fields
+            while True:
+                key = self._value()
+                self._expect(":")
+                if key in SKIPPED_FIELDS:
+                    self._skipValue()
+                elif key == "shapes":
+                    self._expect("[")
+                    if self._peek() == "]":
+                        self._pos += 1
+                    else:
+                        while True:
+                            onShape(self._value())
+                            if self._peek() == "]":
+                                self._pos += 1
+                                break
+                            self._expect(",")
+                else:
+                    fields[key] = self._value()
+                if self._peek() == "}":
+                    return fields
+                self._expect(",")
+        finally:
+            self._file.close()
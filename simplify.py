@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+''' Re-simplifies the polygons of existing annotation files. '''
+
+import argparse
+import glob
+import os
+import sys
+import numpy as np
+import serializer
+from dataset import simplifyPolygon, SIMPLIFY_TOLERANCE
+
+def simplifyFile(path, tolerance, dryRun=False):
+    annotation = serializer.get().load(path)
+
+    before = after = 0
+    for shape in annotation.get("shapes", []):
+        if shape.get("shape_type") != "polygon":
+            continue
+        before += len(shape["points"])
+        points = simplifyPolygon(shape["points"], tolerance)
+        # rounded as Annotation.save does, float32 noise never reaches the file
+        shape["points"] = points.astype(np.float64).round(serializer.get().precision()).tolist()
+        after += len(shape["points"])
+
+    if not dryRun:
+        # written next to the target and renamed so a crash never leaves a truncated file
+        tmpPath = f"{path}.tmp"
+        serializer.get().dump(annotation, tmpPath)
+        os.replace(tmpPath, path)
+    return before, after
+
+def main():
+    parser = argparse.ArgumentParser(description="Simplify the polygons of a dataset's annotations/*.json")
+    parser.add_argument("dataset", help="dataset folder")
+    parser.add_argument("--tolerance", type=float, default=SIMPLIFY_TOLERANCE, help="max deviation in pixels")
+    parser.add_argument("--dry-run", action="store_true", help="report the reduction without writing")
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(f"{args.dataset}/annotations/*.json"))
+    if len(files) == 0:
+        print(f"No annotations found in {args.dataset}/annotations", file=sys.stderr)
+        return 1
+
+    totalBefore = totalAfter = 0
+    sizeBefore = sum(os.path.getsize(f) for f in files)
+    for path in files:
+        before, after = simplifyFile(path, args.tolerance, args.dry_run)
+        totalBefore += before
+        totalAfter += after
+        print(f"{os.path.basename(path)}: {before} -> {after} points")
+
+    print(f"{len(files)} files, {totalBefore} -> {totalAfter} points")
+    if not args.dry_run:
+        sizeAfter = sum(os.path.getsize(f) for f in files)
+        print(f"{sizeBefore} -> {sizeAfter} bytes")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
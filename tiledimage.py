@@ -0,0 +1,161 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+# tifffile reads single tiles of a TIFF, without it large TIFFs are opened whole with PIL
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+# tiled TIFFs with more pixels than this are decoded tile by tile
+TILED_PIXELS = 10000 * 10000
+# bytes of decoded tiles and assembled regions kept
+TILE_CACHE_BUDGET = 1024**3
+
+
+def isTiledImage(path):
+    if tifffile is None or not path.lower().endswith((".tif",".tiff")):
+        return False
+    try:
+        with tifffile.TiffFile(path) as tif:
+            page = tif.pages[0]
+            return page.is_tiled and page.planarconfig == 1 and page.imagelength * page.imagewidth >= TILED_PIXELS
+    except Exception:
+        return False
+
+def _rgb(pixels):
+    # the display pipeline works on 8 bit RGB
+    if pixels.dtype == np.uint16:
+        pixels = (pixels >> 8).astype(np.uint8)
+    elif pixels.dtype != np.uint8:
+        pixels = pixels.clip(0,255).astype(np.uint8)
+    if pixels.ndim == 2:
+        pixels = pixels[...,None]
+    if pixels.shape[2] == 1:
+        return cv2.cvtColor(pixels,cv2.COLOR_GRAY2RGB)
+    return np.ascontiguousarray(pixels[...,:3])
+
+
+class TiledImage:
+    ''' a large tiled TIFF whose tiles are decoded when a region covering them is read '''
+    def __init__(self,path,budget=TILE_CACHE_BUDGET):
+        self._tif = tifffile.TiffFile(path)
+        # full resolution first, then the reduced resolutions stored in the file, if any
+        self._pages = [level.keyframe for level in self._tif.series[0].levels]
+        self._height,self._width = self._pages[0].imagelength, self._pages[0].imagewidth
+        self._factors = [self._width / page.imagewidth for page in self._pages]
+        self._budget = budget
+        self._cache = OrderedDict() # key -> array, least recently used first
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def size(self):
+        return self._height,self._width
+
+    def nbytes(self):
+        return self._nbytes
+
+    def _get(self,key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _put(self,key,value):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = value
+            self._nbytes += value.nbytes
+            while self._nbytes > self._budget and len(self._cache) > 1:
+                _,evicted = self._cache.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def _tileShape(self,page):
+        page = self._pages[page]
+        if not page.is_tiled:
+            return page.imagelength,page.imagewidth
+        return page.tilelength,page.tilewidth
+
+    def _tile(self,page,row,col):
+        tile = self._get((page,row,col))
+        if tile is not None:
+            return tile
+        p = self._pages[page]
+        if not p.is_tiled:
+            # the small reductions at the end of a pyramid are often stripped, they are read whole
+            with self._lock:
+                tile = _rgb(p.asarray())
+        else:
+            index = row * -(-p.imagewidth // p.tilewidth) + col
+            with self._lock:
+                fh = self._tif.filehandle
+                fh.seek(p.dataoffsets[index])
+                data = fh.read(p.databytecounts[index])
+            tile,_,_ = p.decode(data,index,jpegtables=p.jpegtables)
+            if tile is None:
+                # tiles left out of sparse files are blank
+                tile = np.zeros((p.tilelength,p.tilewidth,3),dtype=np.uint8)
+            else:
+                tile = _rgb(tile.reshape(p.tilelength,p.tilewidth,-1))
+        self._put((page,row,col),tile)
+        return tile
+
+    def _read(self,page,x1,y1,x2,y2):
+        # pixels of a stored page, assembled from the tiles covering them
+        th,tw = self._tileShape(page)
+        pixels = np.empty((y2-y1,x2-x1,3),dtype=np.uint8)
+        for row in range(y1//th,(y2-1)//th + 1):
+            for col in range(x1//tw,(x2-1)//tw + 1):
+                tile = self._tile(page,row,col)
+                ty,tx = row*th, col*tw
+                oy1,oy2 = max(y1,ty),min(y2,ty+th)
+                ox1,ox2 = max(x1,tx),min(x2,tx+tw)
+                pixels[oy1-y1:oy2-y1,ox1-x1:ox2-x1] = tile[oy1-ty:oy2-ty,ox1-tx:ox2-tx]
+        return pixels
+
+    def region(self,box,level=0):
+        ''' box in full resolution pixels, aligned on whole 2**level blocks; the returned array is shared, copy before drawing '''
+        key = ("region",tuple(box),level)
+        pixels = self._get(key)
+        if pixels is not None:
+            return pixels
+
+        x1,y1,x2,y2 = box
+        scale = 2**level
+        width,height = (x2-x1)//scale,(y2-y1)//scale
+        pixels = np.empty((height,width,3),dtype=np.uint8)
+        if width == 0 or height == 0:
+            return pixels
+
+        # the stored resolution closest to the level without being coarser
+        page = max((p for p,f in enumerate(self._factors) if f <= scale),key=lambda p: self._factors[p])
+        factor = self._factors[page]
+        ph,pw = self._pages[page].imagelength, self._pages[page].imagewidth
+        px1,py1 = int(x1/factor), int(y1/factor)
+        px2,py2 = min(pw,max(px1+1,int(np.ceil(x2/factor)))), min(ph,max(py1+1,int(np.ceil(y2/factor))))
+        ratio = (py2-py1) / height
+
+        # one band of tile rows at a time, a coarse level never holds the region at full resolution
+        th,_ = self._tileShape(page)
+        start = py1
+        while start < py2:
+            end = min(py2,(start//th + 1)*th)
+            o1,o2 = round((start-py1)/ratio), round((end-py1)/ratio)
+            if o2 > o1:
+                band = self._read(page,px1,start,px2,end)
+                if band.shape[:2] != (o2-o1,width):
+                    band = cv2.resize(band,(width,o2-o1),interpolation=cv2.INTER_AREA)
+                pixels[o1:o2] = band
+            start = end
+        self._put(key,pixels)
+        return pixels
+
+    def close(self):
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
+            self._tif.close()
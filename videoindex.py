@@ -0,0 +1,120 @@
+import json
+import os
+from bisect import bisect_right
+
+# PyAV builds the index and decodes the frames seeked to; without it Video seeks through OpenCV
+try:
+    import av
+except ImportError:
+    av = None
+
+INDEX_VERSION = 2
+
+def indexPath(videoPath):
+    return f"{videoPath}.keyframes.json"
+
+def _signature(videoPath):
+    stat = os.stat(videoPath)
+    return stat.st_size, stat.st_mtime
+
+def buildKeyframeIndex(videoPath):
+    if av is None:
+        return None
+    try:
+        container = av.open(videoPath)
+    except Exception:
+        return None
+
+    stream = container.streams.video[0]
+    timestamps = []
+    keyTimestamps = set()
+    for packet in container.demux(stream):
+        if packet.pts is None:
+            continue
+        timestamps.append(packet.pts)
+        if packet.is_keyframe:
+            keyTimestamps.add(packet.pts)
+    container.close()
+
+    # packets come in decode order, frame numbers follow presentation order
+    timestamps.sort()
+    keyframes = [i for i,pts in enumerate(timestamps) if pts in keyTimestamps]
+    if len(keyframes) == 0 or keyframes[0] != 0:
+        keyframes.insert(0,0)
+    return {"numOfFrames": len(timestamps), "keyframes": keyframes, "timestamps": timestamps}
+
+def loadKeyframeIndex(videoPath):
+    path = indexPath(videoPath)
+    size, mtime = _signature(videoPath)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION and index["size"] == size and index["mtime"] == mtime:
+                return index
+        except (ValueError, KeyError, OSError):
+            pass
+
+    index = buildKeyframeIndex(videoPath)
+    if index is None:
+        return None
+
+    index.update({"version": INDEX_VERSION, "size": size, "mtime": mtime})
+    try:
+        with open(path,"w") as f:
+            f.write(json.dumps(index))
+    except OSError:
+        # read only dataset, the index is still used for this session
+        pass
+    return index
+
+
+class KeyframeReader:
+    ''' frame accurate random access: seeks to the keyframe before a frame by its timestamp and
+        decodes forward to the frame's own timestamp '''
+    def __init__(self,videoPath,index):
+        self._container = av.open(videoPath)
+        self._stream = self._container.streams.video[0]
+        self._stream.thread_type = "AUTO"
+        self._timestamps = index["timestamps"]
+        self._keyframes = index["keyframes"]
+        self._frames = None # decoder position, in presentation order
+        self._last = -1 # frame number decoded last, -1 when unknown
+
+    def read(self,frameNum):
+        if not 0 <= frameNum < len(self._timestamps):
+            return False, None
+        keyframe = self._keyframes[bisect_right(self._keyframes,frameNum)-1]
+        # decodes on from the current position when it is already between the keyframe and the target
+        target = self._timestamps[frameNum]
+        try:
+            if not keyframe <= self._last < frameNum:
+                self._container.seek(self._timestamps[keyframe],stream=self._stream,backward=True)
+                self._frames = self._container.decode(self._stream)
+            for frame in self._frames:
+                if frame.pts is None or frame.pts < target:
+                    continue
+                if frame.pts > target:
+                    # the frame can't be decoded, the next read seeks again
+                    break
+                self._last = frameNum
+                return True, frame.to_ndarray(format="rgb24")
+        except av.error.FFmpegError:
+            pass
+        self._last = -1
+        return False, None
+
+    def close(self):
+        self._container.close()
+
+def openKeyframeReader(videoPath):
+    ''' a KeyframeReader, or None when PyAV is missing or the video can't be indexed '''
+    if av is None:
+        return None
+    index = loadKeyframeIndex(videoPath)
+    if index is None:
+        return None
+    try:
+        return KeyframeReader(videoPath,index)
+    except Exception:
+        return None